@@ -1,27 +1,13 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputTextMessageContent, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-from database import get_total_users_count, get_active_users_today_count, get_total_currency_in_system, get_user_profile, get_user_balance, update_user_balance, ban_user, give_coins_to_all_users, reset_user_balance, get_game_setting, set_game_setting, get_all_user_ids
+from database import get_game_setting, get_pool_stats
+from async_db import get_total_users_count, get_active_users_today_count, get_total_currency_in_system, get_user_profile, get_user_balance, update_user_balance, ban_user, give_coins_to_all_users, reset_user_balance, set_game_setting, get_recent_broadcasts
 import logging
-
-def admin_only(func):
-    """
-    Декоратор, проверяющий, является ли пользователь администратором.
-    """
-    from functools import wraps
-    @wraps(func)
-    async def wrapper(update, context):
-        user_id = update.effective_user.id
-        from database import get_all_admin_ids
-        admin_ids = get_all_admin_ids()
-        from main import OWNER_ID
-        
-        if user_id == OWNER_ID or user_id in admin_ids:
-            return await func(update, context)
-        else:
-            # Пользователь не является администратором
-            return
-    return wrapper
-
+from datetime import datetime
+from decorators import admin_only
+from broadcast import start_broadcast, format_broadcast_status
+from locks import user_locks
+from money import parse_coins, format_coins
 
 def private_only(func):
     """
@@ -46,13 +32,15 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton('👤 Управление пользователями', callback_data='admin_users')],
         [InlineKeyboardButton('💰 Управление экономикой', callback_data='admin_eco')],
         [InlineKeyboardButton('⚙️ Настройки игр', callback_data='admin_games')],
-        [InlineKeyboardButton('🎉 Создать ивент', callback_data='admin_event')]
+        [InlineKeyboardButton('🎉 Создать ивент', callback_data='admin_event')],
+        [InlineKeyboardButton('📨 Рассылки', callback_data='admin_broadcasts')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await update.message.reply_text('Админ-панель:', reply_markup=reply_markup)
 
 
+@admin_only
 async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback-запросов админ-панели"""
     query = update.callback_query
@@ -67,7 +55,8 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             [InlineKeyboardButton('👤 Управление пользователями', callback_data='admin_users')],
             [InlineKeyboardButton('💰 Управление экономикой', callback_data='admin_eco')],
             [InlineKeyboardButton('⚙️ Настройки игр', callback_data='admin_games')],
-            [InlineKeyboardButton('🎉 Создать ивент', callback_data='admin_event')]
+            [InlineKeyboardButton('🎉 Создать ивент', callback_data='admin_event')],
+            [InlineKeyboardButton('📨 Рассылки', callback_data='admin_broadcasts')]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text('Админ-панель:', reply_markup=reply_markup)
@@ -78,6 +67,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
             [InlineKeyboardButton('Общее кол-во пользователей', callback_data='admin_stats_users_total')],
             [InlineKeyboardButton('Кол-во активных сегодня', callback_data='admin_stats_users_active')],
             [InlineKeyboardButton('Общая сумма LumeCoin в системе', callback_data='admin_stats_currency_total')],
+            [InlineKeyboardButton('Пул соединений БД', callback_data='admin_stats_db_pool')],
             [InlineKeyboardButton('🔙 Назад', callback_data='admin_main')]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -86,14 +76,25 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     elif data.startswith('admin_stats_'):
         # Обработка статистики
         if data == 'admin_stats_users_total':
-            count = get_total_users_count()
+            count = await get_total_users_count()
             await query.edit_message_text(f'Общее количество пользователей: {count}')
         elif data == 'admin_stats_users_active':
-            count = get_active_users_today_count()
+            count = await get_active_users_today_count()
             await query.edit_message_text(f'Количество активных пользователей сегодня: {count}')
         elif data == 'admin_stats_currency_total':
-            total = get_total_currency_in_system()
-            await query.edit_message_text(f'Общая сумма LumeCoin в системе: {total}')
+            total = await get_total_currency_in_system()
+            await query.edit_message_text(f'Общая сумма LumeCoin в системе: {format_coins(total)}')
+        elif data == 'admin_stats_db_pool':
+            stats = get_pool_stats()
+            pool_info = 'Пул соединений БД:\n'
+            pool_info += f'Соединений: {stats["created"]}/{stats["size"]} (занято {stats["in_use"]}, пик {stats["peak_in_use"]})\n'
+            pool_info += f'Выдано всего: {stats["acquired_total"]}\n'
+            pool_info += f'Ожиданий: {stats["waits"]} (среднее {stats["avg_wait_ms"]:.1f} мс), таймаутов: {stats["timeouts"]}\n'
+            pool_info += f'Закрыто сломанных: {stats["discarded"]}\n'
+            writer = stats['writer']
+            pool_info += (f'Групповая запись: {writer["operations"]} операций в {writer["batches"]} транзакциях '
+                          f'(в среднем {writer["avg_batch"]:.1f}), в очереди {writer["queued"]}')
+            await query.edit_message_text(pool_info)
         
         # Добавляем кнопку назад
         keyboard = [[InlineKeyboardButton('🔙 Назад', callback_data='admin_stats')]]
@@ -131,7 +132,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
                 context.user_data['waiting_for_coin_amount'] = {'user_id': user_id, 'action': 'take'}
             elif action == 'ban':
                 # Блокируем пользователя
-                ban_user(user_id)
+                await ban_user(user_id)
                 await query.edit_message_text(f'Пользователь {user_id} успешно заблокирован')
                 keyboard = [[InlineKeyboardButton('🔙 Назад', callback_data=f'admin_users_info_{user_id}')]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -270,8 +271,25 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         # Меню создания ивента
         await query.edit_message_text('Введите сообщение для отправки всем пользователям:')
         context.user_data['waiting_for_event_message'] = True
+    
+    elif data in ('admin_broadcasts', 'admin_broadcasts_refresh'):
+        # Статус последних рассылок (время обновления в тексте, чтобы "Обновить" всегда менял сообщение)
+        broadcasts = await get_recent_broadcasts(5)
+        if broadcasts:
+            status_text = '📨 Последние рассылки:\n\n' + '\n'.join(format_broadcast_status(b) for b in broadcasts)
+        else:
+            status_text = '📨 Рассылок пока не было.'
+        status_text += f'\n\nОбновлено: {datetime.now().strftime("%H:%M:%S")}'
+        
+        keyboard = [
+            [InlineKeyboardButton('🔄 Обновить', callback_data='admin_broadcasts_refresh')],
+            [InlineKeyboardButton('🔙 Назад', callback_data='admin_main')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(status_text, reply_markup=reply_markup)
 
 
+@admin_only
 async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода пользователя (ID пользователя или суммы монет)"""
     if 'waiting_for_user_id' in context.user_data and context.user_data['waiting_for_user_id']:
@@ -281,13 +299,13 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['waiting_for_user_id'] = False
             
             # Получаем информацию о пользователе
-            level, xp, balance = get_user_profile(user_id)
+            level, xp, balance = await get_user_profile(user_id)
             
             # Формируем сообщение с информацией о пользователе
             user_info = f'Информация о пользователе {user_id}:\n'
             user_info += f'Уровень: {level}\n'
             user_info += f'Опыт: {xp}\n'
-            user_info += f'Баланс: {balance} LumeCoin\n'
+            user_info += f'Баланс: {format_coins(balance)} LumeCoin\n'
             
             # Создаем клавиатуру с действиями
             keyboard = [
@@ -306,29 +324,33 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif 'waiting_for_coin_amount' in context.user_data:
         # Обработка ввода суммы монет
         try:
-            amount = float(update.message.text)
+            amount = parse_coins(update.message.text)
+            if amount is None:
+                raise ValueError(update.message.text)
             user_data = context.user_data['waiting_for_coin_amount']
             user_id = user_data['user_id']
             action = user_data['action']
             
-            if action == 'give':
-                # Выдаем монеты пользователю
-                update_user_balance(user_id, amount)
-                await update.message.reply_text(f'Пользователю {user_id} выдано {amount} LumeCoin')
-            elif action == 'take':
-                # Изымаем монеты у пользователя (передаем отрицательное значение)
-                update_user_balance(user_id, -amount)
-                await update.message.reply_text(f'У пользователя {user_id} изъято {amount} LumeCoin')
+            # Изменение баланса - под блокировкой пользователя
+            async with user_locks.hold(user_id):
+                if action == 'give':
+                    # Выдаем монеты пользователю
+                    await update_user_balance(user_id, amount, reason='admin')
+                    await update.message.reply_text(f'Пользователю {user_id} выдано {format_coins(amount)} LumeCoin')
+                elif action == 'take':
+                    # Изымаем монеты у пользователя (передаем отрицательное значение)
+                    await update_user_balance(user_id, -amount, reason='admin')
+                    await update.message.reply_text(f'У пользователя {user_id} изъято {format_coins(amount)} LumeCoin')
             
             # Убираем флаг ожидания
             del context.user_data['waiting_for_coin_amount']
             
             # Возвращаемся к информации о пользователе
-            level, xp, balance = get_user_profile(user_id)
+            level, xp, balance = await get_user_profile(user_id)
             user_info = f'Информация о пользователе {user_id}:\n'
             user_info += f'Уровень: {level}\n'
             user_info += f'Опыт: {xp}\n'
-            user_info += f'Баланс: {balance} LumeCoin\n'
+            user_info += f'Баланс: {format_coins(balance)} LumeCoin\n'
             
             # Создаем клавиатуру с действиями
             keyboard = [
@@ -347,12 +369,14 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif 'waiting_for_bulk_coin_amount' in context.user_data and context.user_data['waiting_for_bulk_coin_amount']:
         # Обработка ввода суммы для выдачи всем пользователям
         try:
-            amount = float(update.message.text)
+            amount = parse_coins(update.message.text)
+            if amount is None:
+                raise ValueError(update.message.text)
             context.user_data['waiting_for_bulk_coin_amount'] = False
             
             # Выдаем монеты всем пользователям
-            give_coins_to_all_users(amount)
-            await update.message.reply_text(f'Всем пользователям выдано {amount} LumeCoin')
+            await give_coins_to_all_users(amount)
+            await update.message.reply_text(f'Всем пользователям выдано {format_coins(amount)} LumeCoin')
             
             # Убираем флаг ожидания
             del context.user_data['waiting_for_bulk_coin_amount']
@@ -367,7 +391,7 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['waiting_for_reset_user_id'] = False
             
             # Обнуляем баланс пользователя
-            reset_user_balance(user_id)
+            await reset_user_balance(user_id)
             await update.message.reply_text(f'Баланс пользователя {user_id} успешно обнулен')
             
         except ValueError:
@@ -382,7 +406,7 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 setting_key = setting_data['setting']
                 
                 # Устанавливаем новое значение настройки
-                set_game_setting(setting_key, str(value))
+                await set_game_setting(setting_key, str(value))
                 
                 await update.message.reply_text(f'Настройка "{setting_key}" успешно изменена на {value}%')
                 
@@ -398,20 +422,12 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         event_message = update.message.text
         context.user_data['waiting_for_event_message'] = False
         
-        # Получаем всех пользователей
-        user_ids = get_all_user_ids()
-        
-        # Отправляем сообщение всем пользователям
-        successful_sends = 0
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(chat_id=user_id, text=f'🎉 СООБЩЕНИЕ ОТ АДМИНИСТРАЦИИ:\n\n{event_message}')
-                successful_sends += 1
-            except Exception:
-                # Если не удалось отправить сообщение пользователю (например, бот заблокирован), пропускаем
-                pass
+        # Запускаем рассылку в фоне: обработчик не ждет, пока сообщение получат все пользователи
+        broadcast_id = await start_broadcast(context.application, event_message, update.effective_chat.id)
         
-        await update.message.reply_text(f'Сообщение ивента успешно отправлено {successful_sends} пользователям из {len(user_ids)}')
+        await update.message.reply_text(
+            f'Рассылка #{broadcast_id} запущена. Прогресс можно посмотреть в разделе "📨 Рассылки" админ-панели.'
+        )
         
         # Убираем флаг ожидания
         del context.user_data['waiting_for_event_message']
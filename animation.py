@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from functools import wraps
+from deletion import schedule_deletion
+
+logger = logging.getLogger(__name__)
+
+# Кадр анимации: (задержка перед кадром в секундах, корутина-функция без аргументов)
+Frame = tuple[float, Callable[[], Awaitable]]
+
+# Пользователи с незавершенным раундом: user_id -> True, если раунд передан анимации
+_in_flight = {}
+
+
+def play_sequence(application, frames: list[Frame], user_id: int | None = None) -> asyncio.Task:
+    """
+    Запускает кадры анимации фоновой задачей приложения и сразу возвращает управление.
+    Если передан user_id, раунд пользователя считается незавершенным до конца анимации.
+    """
+    if user_id is not None:
+        _in_flight[user_id] = True
+    return application.create_task(_run_frames(frames, user_id))
+
+
+async def _run_frames(frames: list[Frame], user_id: int | None):
+    """
+    Последовательно выполняет кадры анимации с заданными задержками.
+    """
+    try:
+        for delay, frame in frames:
+            if delay:
+                await asyncio.sleep(delay)
+            await frame()
+    except Exception as e:
+        logger.warning(f'Ошибка при проигрывании анимации: {e}')
+    finally:
+        if user_id is not None:
+            _in_flight.pop(user_id, None)
+
+
+def one_round_at_a_time(func):
+    """
+    Декоратор для игровых команд: не дает пользователю начать новый раунд,
+    пока не закончилась анимация предыдущего.
+    """
+    @wraps(func)
+    async def wrapper(update, context):
+        user_id = update.effective_user.id
+        if user_id in _in_flight:
+            message = await update.message.reply_text('⏳ Дождитесь окончания предыдущей игры.')
+            schedule_deletion(update.effective_chat.id, update.message.id, message.id)
+            return
+
+        _in_flight[user_id] = False
+        try:
+            return await func(update, context)
+        finally:
+            # Если анимация не была запущена, раунд завершается вместе с обработчиком
+            if not _in_flight.get(user_id):
+                _in_flight.pop(user_id, None)
+    return wrapper
@@ -4,13 +4,16 @@ import hashlib
 import hmac
 import os
 from database import (
-    get_user_balance, update_user_balance, get_user_profile, 
+    update_user_balance, debit_if_sufficient, settle_round, settle_penalty, get_user_profile, 
     get_user_achievements, get_referral_count, add_xp,
     get_referrer_id, get_referral_reward_status, mark_referral_reward_as_claimed,
     add_referral, get_user_by_id, can_open_case, update_last_open_case_time
 )
-from games import roulette, play, russian, jewish, dice, slots
+from games import roulette, play, russian, jewish, dice, slots, slots_payout
 from titles import PERMANENT_TITLES, TEMPORARY_TITLES
+from leveling import level_curve
+from locks import user_locks
+from money import CENTS_PER_COIN, to_cents, from_cents, parse_json_coins, scale, format_coins
 from referrals import ref_command
 import random
 from datetime import datetime
@@ -103,7 +106,7 @@ def get_user_data():
     level, xp, balance = profile
     
     # Получаем максимальный XP для текущего уровня
-    xp_needed = level * 500
+    xp_needed = level_curve.xp_to_next(level)
     
     # Получаем достижения пользователя
     achievements = get_user_achievements(user_id)
@@ -126,7 +129,7 @@ def get_user_data():
     return jsonify({
         'success': True,
         'data': {
-            'balance': balance,
+            'balance': from_cents(balance),
             'level': level,
             'xp': xp,
             'xp_needed': xp_needed,
@@ -166,214 +169,138 @@ def play_game(game_type):
     if not user_id:
         return jsonify({'success': False, 'message': 'Could not extract user ID'}), 400
     
-    bet = data.get('bet', 0)
-    
     # Проверяем, что игра существует
     if game_type not in ['roulette', 'play', 'russian', 'jewish', 'dice', 'slots']:
         return jsonify({'success': False, 'message': 'Invalid game type'}), 400
     
-    # Проверяем баланс пользователя
-    balance = get_user_balance(user_id)
+    # Ставка приходит в монетах, дальше считается в сотых долях.
+    # В play ставка фиксированная, а russian и jewish бесплатные - их ставку не проверяем
+    bet = 0
+    if game_type in ['roulette', 'dice', 'slots']:
+        bet = parse_json_coins(data.get('bet', 0))
+        if bet is None:
+            return jsonify({'success': False, 'message': 'Invalid bet'}), 400
     
     # Проверяем минимальные ставки для различных игр
-    if game_type in ['roulette'] and bet < 25:
+    if game_type in ['roulette'] and bet < to_cents(25):
         return jsonify({'success': False, 'message': 'Minimum bet for roulette is 25 LumeCoin'}), 400
-    elif game_type in ['dice'] and (bet < 10 or bet > 100):
+    elif game_type in ['dice'] and (bet < to_cents(10) or bet > to_cents(100)):
         return jsonify({'success': False, 'message': 'Bet for dice must be between 10 and 100 LumeCoin'}), 400
-    elif game_type in ['slots'] and bet < 50:
+    elif game_type in ['slots'] and bet < to_cents(50):
         return jsonify({'success': False, 'message': 'Minimum bet for slots is 50 LumeCoin'}), 400
-    elif game_type in ['play'] and bet != 25:
+    elif game_type in ['play'] and bet != to_cents(25):
         # Для игры play фиксированная ставка 25
-        bet = 25
-    
-    if game_type not in ['russian', 'jewish'] and balance < bet:
+        bet = to_cents(25)
+    
+    # Раунды одного пользователя выполняются по очереди
+    with user_locks.hold_sync(user_id):
+        # Выполняем игру (баланс проверяется при проведении раунда)
+        if game_type == 'roulette':
+            return handle_roulette_game(user_id, bet)
+        elif game_type == 'play':
+            return handle_play_game(user_id)
+        elif game_type == 'russian':
+            return handle_russian_game(user_id)
+        elif game_type == 'jewish':
+            return handle_jewish_game(user_id)
+        elif game_type == 'dice':
+            return handle_dice_game(user_id, bet)
+        elif game_type == 'slots':
+            return handle_slots_game(user_id, bet)
+
+def round_result(new_balance: int | None, winnings: int):
+    """
+    Формирует ответ по итогам игрового раунда (суммы в ответе - в монетах)
+    """
+    if new_balance is None:
         return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
     
-    # Выполняем игру
-    if game_type == 'roulette':
-        return handle_roulette_game(user_id, bet)
-    elif game_type == 'play':
-        return handle_play_game(user_id)
-    elif game_type == 'russian':
-        return handle_russian_game(user_id)
-    elif game_type == 'jewish':
-        return handle_jewish_game(user_id)
-    elif game_type == 'dice':
-        return handle_dice_game(user_id, bet)
-    elif game_type == 'slots':
-        return handle_slots_game(user_id, bet)
+    return jsonify({
+        'success': True,
+        'winnings': from_cents(winnings),
+        'new_balance': from_cents(new_balance)
+    })
 
-def handle_roulette_game(user_id: int, bet: float):
+def handle_roulette_game(user_id: int, bet: int):
     """
     Обработка игры в рулетку
     """
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
-    # Определяем результат (30% шанс выигрыша)
-    import random
+    # Определяем результат (30% шанс выигрыша, x2)
     result = random.choices(['win', 'lose'], weights=[30, 70])[0]
+    winnings = scale(bet, 2) if result == 'win' else 0
     
-    if result == 'win':
-        # Выигрыш (x2)
-        win_amount = bet * 2
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    else:
-        # Проигрыш
-        winnings = 0
-    
-    new_balance = get_user_balance(user_id)
+    # Списываем ставку и начисляем выигрыш одной транзакцией
+    new_balance = settle_round(user_id, bet, winnings)
     
-    return jsonify({
-        'success': True,
-        'winnings': winnings,
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
 def handle_play_game(user_id: int):
     """
     Обработка игры в кости (фиксированная ставка 25)
     """
-    bet = 25
+    bet = to_cents(25)
     
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
-    # Определяем результат (40% шанс выигрыша)
-    import random
+    # Определяем результат (40% шанс выиграть 40 LumeCoin)
     result = random.choices(['win', 'lose'], weights=[40, 60])[0]
+    winnings = to_cents(40) if result == 'win' else 0
     
-    if result == 'win':
-        # Выигрыш 40 LumeCoin
-        win_amount = 40
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    else:
-        # Проигрыш
-        winnings = 0
-    
-    new_balance = get_user_balance(user_id)
+    new_balance = settle_round(user_id, bet, winnings)
     
-    return jsonify({
-        'success': True,
-        'winnings': winnings,
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
 def handle_russian_game(user_id: int):
     """
     Обработка русской рулетки (бесплатно, 35% шанс выигрыша)
     """
-    # Определяем результат (35% шанс выигрыша)
-    import random
+    # Определяем результат (35% шанс выиграть 35 LumeCoin)
     result = random.choices(['win', 'lose'], weights=[35, 65])[0]
+    winnings = to_cents(35) if result == 'win' else 0
     
-    if result == 'win':
-        # Выигрыш 35 LumeCoin
-        win_amount = 35
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    else:
-        # Проигрыш
-        winnings = 0
-    
-    new_balance = get_user_balance(user_id)
+    new_balance = settle_round(user_id, 0, winnings)
     
-    return jsonify({
-        'success': True,
-        'winnings': winnings,
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
 def handle_jewish_game(user_id: int):
     """
     Обработка еврейской рулетки (бесплатно, 50% шанс выигрыша)
     """
     # Определяем результат (50% шанс выигрыша)
-    import random
     result = random.choices(['win', 'lose'], weights=[50, 50])[0]
     
     if result == 'win':
         # Выигрыш 25 LumeCoin
-        win_amount = 25
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
+        winnings = to_cents(25)
+        new_balance = settle_round(user_id, 0, winnings)
     else:
-        # Проигрыш 35 LumeCoin или всё, что есть
-        balance = get_user_balance(user_id)
-        loss_amount = min(35, balance)
-        update_user_balance(user_id, -loss_amount)
-        winnings = -loss_amount
-    
-    new_balance = get_user_balance(user_id)
+        # Проигрыш 35 LumeCoin или всё, что есть; штраф списывается без ухода баланса в минус
+        loss, new_balance = settle_penalty(user_id, to_cents(35))
+        winnings = -loss
     
-    return jsonify({
-        'success': True,
-        'winnings': abs(winnings) if winnings >= 0 else -abs(winnings),
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
-def handle_dice_game(user_id: int, bet: float):
+def handle_dice_game(user_id: int, bet: int):
     """
     Обработка игры в кости с Telegram-анимацией
     """
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
-    # Симулируем бросок кубика (1-6)
-    import random
+    # Симулируем бросок кубика (1-6), при значении ≥ 4 выигрыш x1.5
     dice_value = random.randint(1, 6)
+    winnings = scale(bet, '1.5') if dice_value >= 4 else 0
     
-    if dice_value >= 4:
-        # Выигрыш x1.5
-        win_amount = bet * 1.5
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    else:
-        # Проигрыш
-        winnings = 0
-    
-    new_balance = get_user_balance(user_id)
+    new_balance = settle_round(user_id, bet, winnings)
     
-    return jsonify({
-        'success': True,
-        'winnings': winnings,
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
-def handle_slots_game(user_id: int, bet: float):
+def handle_slots_game(user_id: int, bet: int):
     """
     Обработка игры в слоты
     """
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
     # Симулируем результат слотов (1-64)
-    import random
     dice_value = random.randint(1, 64)
+    winnings = slots_payout(bet, dice_value)
     
-    if dice_value == 1:
-        # Джекпот - 3 совпадения
-        win_amount = bet * 5
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    elif 2 <= dice_value <= 7:
-        # 2 совпадения
-        win_amount = bet * 2
-        update_user_balance(user_id, win_amount)
-        winnings = win_amount
-    else:
-        # Проигрыш
-        winnings = 0
-    
-    new_balance = get_user_balance(user_id)
+    new_balance = settle_round(user_id, bet, winnings)
     
-    return jsonify({
-        'success': True,
-        'winnings': winnings,
-        'new_balance': new_balance
-    })
+    return round_result(new_balance, winnings)
 
 @app.route('/api/title/buy', methods=['POST'])
 @verify_webapp_init_data
@@ -394,19 +321,17 @@ def buy_title():
     if title_type == 'permanent':
         if title not in PERMANENT_TITLES:
             return jsonify({'success': False, 'message': 'Invalid permanent title'}), 400
-        price = PERMANENT_TITLES[title]
+        price = to_cents(PERMANENT_TITLES[title])
     else:
         if title not in TEMPORARY_TITLES:
             return jsonify({'success': False, 'message': 'Invalid temporary title'}), 400
-        price = TEMPORARY_TITLES[title]['price']
-    
-    # Проверяем баланс пользователя
-    balance = get_user_balance(user_id)
-    if balance < price:
-        return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
+        price = to_cents(TEMPORARY_TITLES[title]['price'])
     
-    # Снимаем средства
-    update_user_balance(user_id, -price)
+    # Проверка баланса и списание - одна операция: блокировка пользователя
+    # действует только внутри процесса, а бот списывает средства параллельно
+    with user_locks.hold_sync(user_id):
+        if debit_if_sufficient(user_id, price, reason='title') is None:
+            return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
     
     # В реальном приложении здесь нужно было бы:
     # 1. Вызвать соответствующую функцию из titles.py
@@ -430,45 +355,43 @@ def open_case():
     if not user_id:
         return jsonify({'success': False, 'message': 'Could not extract user ID'}), 400
     
-    # Проверяем, можно ли открыть кейс
-    if not can_open_case(user_id):
-        return jsonify({'success': False, 'message': 'You already opened a case in the last 24 hours'}), 400
-    
-    # Стоимость кейса
-    case_cost = 10  # В реальности может быть другой
-    
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
-    if balance < case_cost:
-        return jsonify({'success': False, 'message': 'Insufficient balance to open case'}), 400
-    
-    # Снимаем стоимость кейса
-    update_user_balance(user_id, -case_cost)
-    
-    # Определяем приз
-    prizes = [
-        {'type': 'coin', 'value': random.randint(50, 200), 'description': 'LumeCoin'},
-        {'type': 'xp', 'value': random.randint(50, 300), 'description': 'XP'},
-        {'type': 'rare', 'value': 'Редкое достижение', 'description': 'редкое достижение'}
-    ]
-    
-    # Взвешенный выбор приза (меньше шансов на редкий приз)
-    weights = [0.7, 0.25, 0.05]  # 70% на монеты, 25% на XP, 5% на редкий приз
-    prize = random.choices(prizes, weights=weights, k=1)[0]
-    
-    # Выдаем приз
-    if prize['type'] == 'coin':
-        update_user_balance(user_id, prize['value'])
-        reward = f'{prize["value"]} {prize["description"]}'
-    elif prize['type'] == 'xp':
-        add_xp(user_id, prize['value'])
-        reward = f'{prize["value"]} {prize["description"]}'
-    else:  # rare achievement
-        # В реальной реализации можно добавить запись о достижении в БД
-        reward = f'{prize["value"]}'
-    
-    # Обновляем время последнего открытия кейса
-    update_last_open_case_time(user_id)
+    # Проверка, списание и выдача приза - под блокировкой пользователя
+    with user_locks.hold_sync(user_id):
+        # Проверяем, можно ли открыть кейс
+        if not can_open_case(user_id):
+            return jsonify({'success': False, 'message': 'You already opened a case in the last 24 hours'}), 400
+    
+        # Стоимость кейса
+        case_cost = to_cents(10)  # В реальности может быть другой
+    
+        # Снимаем стоимость кейса до выдачи приза, только если хватает средств
+        if debit_if_sufficient(user_id, case_cost, reason='case') is None:
+            return jsonify({'success': False, 'message': 'Insufficient balance to open case'}), 400
+    
+        # Определяем приз
+        prizes = [
+            {'type': 'coin', 'value': to_cents(random.randint(50, 200)), 'description': 'LumeCoin'},
+            {'type': 'xp', 'value': random.randint(50, 300), 'description': 'XP'},
+            {'type': 'rare', 'value': 'Редкое достижение', 'description': 'редкое достижение'}
+        ]
+    
+        # Взвешенный выбор приза (меньше шансов на редкий приз)
+        weights = [0.7, 0.25, 0.05]  # 70% на монеты, 25% на XP, 5% на редкий приз
+        prize = random.choices(prizes, weights=weights, k=1)[0]
+    
+        # Выдаем приз
+        if prize['type'] == 'coin':
+            update_user_balance(user_id, prize['value'], reason='case')
+            reward = f'{format_coins(prize["value"])} {prize["description"]}'
+        elif prize['type'] == 'xp':
+            add_xp(user_id, prize['value'])
+            reward = f'{prize["value"]} {prize["description"]}'
+        else:  # rare achievement
+            # В реальной реализации можно добавить запись о достижении в БД
+            reward = f'{prize["value"]}'
+    
+        # Обновляем время последнего открытия кейса
+        update_last_open_case_time(user_id)
     
     return jsonify({
         'success': True,
@@ -487,24 +410,22 @@ def burn_coins():
     if not user_id:
         return jsonify({'success': False, 'message': 'Could not extract user ID'}), 400
     
-    amount = data.get('amount', 0)
+    amount = parse_json_coins(data.get('amount', 0))
     
-    if amount <= 0:
+    if amount is None or amount <= 0:
         return jsonify({'success': False, 'message': 'Invalid amount'}), 400
     
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
-    if balance < amount:
-        return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
-    
-    # Сжигаем монеты и начисляем XP (1:2)
-    update_user_balance(user_id, -amount)
-    xp_gained = amount * 2
-    add_xp(user_id, int(xp_gained))
+    # Проверка баланса и сжигание - под блокировкой пользователя
+    with user_locks.hold_sync(user_id):
+        # Сжигаем монеты, только если их хватает, и начисляем XP (1:2)
+        if debit_if_sufficient(user_id, amount, reason='burn') is None:
+            return jsonify({'success': False, 'message': 'Insufficient balance'}), 400
+        xp_gained = amount * 2 // CENTS_PER_COIN
+        add_xp(user_id, xp_gained)
     
     return jsonify({
         'success': True,
-        'xp_gained': int(xp_gained)
+        'xp_gained': xp_gained
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+import database
+
+# Асинхронный фасад над database.py: каждый запрос к SQLite выполняется в отдельном
+# потоке-исполнителе, поэтому медленная запись на диск не останавливает цикл событий бота.
+# Функции, которые читают только кэш в памяти (get_bound_supergroup_id, get_admin_ids,
+# get_game_setting, queue_interaction, get_pool_stats), вызываются напрямую из database.
+
+# Записи ждут общего COMMIT потока записи и не занимают соединение пула,
+# поэтому потоков больше, чем соединений: иначе в одну транзакцию попадало бы не больше DB_POOL_SIZE записей
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '32'))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+
+async def run_in_db(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию работы с базой в потоке-исполнителе и возвращает ее результат.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def _wrap(func):
+    """
+    Делает из синхронной функции database.py awaitable-версию с той же сигнатурой.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    """
+    Дожидается завершения начатых запросов и останавливает потоки-исполнители.
+    """
+    _executor.shutdown(wait=True)
+
+
+checkpoint_wal = _wrap(database.checkpoint_wal)
+get_user_balance = _wrap(database.get_user_balance)
+adjust_balance = _wrap(database.adjust_balance)
+update_user_balance = _wrap(database.update_user_balance)
+debit_if_sufficient = _wrap(database.debit_if_sufficient)
+settle_round = _wrap(database.settle_round)
+settle_penalty = _wrap(database.settle_penalty)
+transfer = _wrap(database.transfer)
+reload_leaderboard = _wrap(database.reload_leaderboard)
+get_top_users_by_balance = _wrap(database.get_top_users_by_balance)
+set_bound_supergroup_id = _wrap(database.set_bound_supergroup_id)
+get_all_admin_ids = _wrap(database.get_all_admin_ids)
+add_admin = _wrap(database.add_admin)
+remove_admin = _wrap(database.remove_admin)
+add_xp = _wrap(database.add_xp)
+add_xp_batch = _wrap(database.add_xp_batch)
+get_user_profile = _wrap(database.get_user_profile)
+grant_achievement = _wrap(database.grant_achievement)
+get_user_achievements = _wrap(database.get_user_achievements)
+get_user_discount_tier = _wrap(database.get_user_discount_tier)
+set_user_discount_tier = _wrap(database.set_user_discount_tier)
+get_available_vpn_code = _wrap(database.get_available_vpn_code)
+add_vpn_codes = _wrap(database.add_vpn_codes)
+add_referral = _wrap(database.add_referral)
+get_referrer_id = _wrap(database.get_referrer_id)
+get_referral_count = _wrap(database.get_referral_count)
+get_referral_reward_status = _wrap(database.get_referral_reward_status)
+mark_referral_reward_as_claimed = _wrap(database.mark_referral_reward_as_claimed)
+get_total_users_count = _wrap(database.get_total_users_count)
+get_active_users_today_count = _wrap(database.get_active_users_today_count)
+get_total_currency_in_system = _wrap(database.get_total_currency_in_system)
+ban_user = _wrap(database.ban_user)
+is_user_banned = _wrap(database.is_user_banned)
+get_user_ids_page = _wrap(database.get_user_ids_page)
+create_broadcast = _wrap(database.create_broadcast)
+update_broadcast_progress = _wrap(database.update_broadcast_progress)
+get_broadcast = _wrap(database.get_broadcast)
+get_recent_broadcasts = _wrap(database.get_recent_broadcasts)
+get_running_broadcast_ids = _wrap(database.get_running_broadcast_ids)
+save_pending_deletions = _wrap(database.save_pending_deletions)
+remove_pending_deletions = _wrap(database.remove_pending_deletions)
+get_pending_deletions = _wrap(database.get_pending_deletions)
+give_coins_to_all_users = _wrap(database.give_coins_to_all_users)
+reset_user_balance = _wrap(database.reset_user_balance)
+get_ledger_entries = _wrap(database.get_ledger_entries)
+replay_balance = _wrap(database.replay_balance)
+snapshot_balances = _wrap(database.snapshot_balances)
+compact_ledger = _wrap(database.compact_ledger)
+set_game_setting = _wrap(database.set_game_setting)
+get_all_user_ids = _wrap(database.get_all_user_ids)
+add_temp_title = _wrap(database.add_temp_title)
+get_expired_titles = _wrap(database.get_expired_titles)
+remove_temp_title = _wrap(database.remove_temp_title)
+add_interaction = _wrap(database.add_interaction)
+flush_interactions = _wrap(database.flush_interactions)
+get_users_to_remind_page = _wrap(database.get_users_to_remind_page)
+mark_users_reminded = _wrap(database.mark_users_reminded)
+get_inactive_users_page = _wrap(database.get_inactive_users_page)
+get_inactive_users = _wrap(database.get_inactive_users)
+get_user_by_id = _wrap(database.get_user_by_id)
+save_display_names = _wrap(database.save_display_names)
+get_display_name_record = _wrap(database.get_display_name_record)
+can_open_case = _wrap(database.can_open_case)
+update_last_open_case_time = _wrap(database.update_last_open_case_time)
+get_active_vote = _wrap(database.get_active_vote)
+add_vote_for_option = _wrap(database.add_vote_for_option)
+has_user_voted = _wrap(database.has_user_voted)
+get_faq_answer = _wrap(database.get_faq_answer)
+add_faq_entry = _wrap(database.add_faq_entry)
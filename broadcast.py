@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import time
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from async_db import (
+    get_user_ids_page, create_broadcast, update_broadcast_progress,
+    get_broadcast, get_running_broadcast_ids
+)
+
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))  # Сообщений в секунду по всем чатам
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1'))  # Минимальный интервал для одного чата, сек
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))  # Одновременных отправок
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '500'))  # Пользователей на страницу (и на одно сохранение прогресса)
+BROADCAST_MAX_RETRIES = 3  # Повторов одного сообщения после RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Задачи активных рассылок: broadcast_id -> asyncio.Task
+_running = {}
+
+
+class RateLimiter:
+    """
+    Ограничитель скорости отправки: общий token bucket плюс минимальный интервал
+    между сообщениями в один чат. При RetryAfter от Telegram приостанавливает все отправки.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.per_chat_interval = per_chat_interval
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_sent = {}  # chat_id -> время последней отправки
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Приостанавливает все отправки на указанное время.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        """
+        Ждет, пока можно будет отправить сообщение в чат chat_id.
+        """
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                wait = max(
+                    self._paused_until - now,
+                    self._last_sent.get(chat_id, 0.0) + self.per_chat_interval - now,
+                    (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0,
+                )
+                if wait <= 0:
+                    self._tokens -= 1
+                    self._last_sent[chat_id] = now
+                    self._prune(now)
+                    return
+
+            await asyncio.sleep(wait)
+
+    def _prune(self, now: float):
+        """
+        Удаляет устаревшие записи об отправках, чтобы словарь не рос бесконечно.
+        """
+        if len(self._last_sent) > 10000:
+            self._last_sent = {
+                chat_id: sent_at for chat_id, sent_at in self._last_sent.items()
+                if now - sent_at < self.per_chat_interval
+            }
+
+
+# Общий ограничитель для всех массовых отправок бота (рассылок и напоминаний):
+# лимит Telegram действует на бота целиком, а не на каждую рассылку отдельно
+rate_limiter = RateLimiter()
+
+
+async def send_limited(bot, limiter: RateLimiter, semaphore: asyncio.Semaphore, chat_id: int, text: str) -> bool:
+    """
+    Отправляет одно сообщение с учетом ограничений. Возвращает True при успехе.
+    """
+    async with semaphore:
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await limiter.acquire(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                # Telegram просит подождать: останавливаем всю рассылку, а не только этот чат
+                limiter.pause(e.retry_after)
+            except (Forbidden, BadRequest):
+                # Бот заблокирован пользователем или чат недоступен
+                return False
+            except Exception as e:
+                logger.warning(f'Не удалось отправить сообщение в {chat_id}: {e}')
+                return False
+    return False
+
+
+async def run_broadcast(bot, broadcast_id: int):
+    """
+    Выполняет рассылку, начиная с сохраненной позиции. Прогресс сохраняется
+    после каждой страницы пользователей, поэтому после перезапуска рассылка продолжается.
+    """
+    broadcast = await get_broadcast(broadcast_id)
+    if broadcast is None or broadcast['status'] != 'running':
+        return
+
+    text = f"🎉 СООБЩЕНИЕ ОТ АДМИНИСТРАЦИИ:\n\n{broadcast['text']}"
+    last_user_id = broadcast['last_user_id']
+    sent, failed = broadcast['sent'], broadcast['failed']
+
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    try:
+        while True:
+            user_ids = await get_user_ids_page(last_user_id, BROADCAST_PAGE_SIZE)
+            if not user_ids:
+                break
+
+            results = await asyncio.gather(
+                *(send_limited(bot, rate_limiter, semaphore, user_id, text) for user_id in user_ids)
+            )
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            last_user_id = user_ids[-1]
+            await update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+    except Exception as e:
+        logger.error(f'Рассылка #{broadcast_id} прервана: {e}')
+        await update_broadcast_progress(broadcast_id, last_user_id, sent, failed, status='failed')
+        return
+    finally:
+        _running.pop(broadcast_id, None)
+
+    await update_broadcast_progress(broadcast_id, last_user_id, sent, failed, status='done')
+
+    try:
+        await bot.send_message(
+            chat_id=broadcast['admin_chat_id'],
+            text=f'Рассылка #{broadcast_id} завершена: доставлено {sent}, не доставлено {failed}.'
+        )
+    except Exception as e:
+        logger.warning(f'Не удалось отправить отчет о рассылке #{broadcast_id}: {e}')
+
+
+def _start_task(application, broadcast_id: int):
+    """
+    Запускает рассылку фоновой задачей. Задача создается напрямую через asyncio, а не через
+    application.create_task: иначе Application.stop() ждал бы окончания всей рассылки.
+    """
+    _running[broadcast_id] = asyncio.create_task(run_broadcast(application.bot, broadcast_id))
+
+
+async def start_broadcast(application, text: str, admin_chat_id: int) -> int:
+    """
+    Создает рассылку и запускает ее в фоне, не блокируя обработку обновлений.
+    Возвращает ID рассылки.
+    """
+    broadcast_id = await create_broadcast(text, admin_chat_id)
+    _start_task(application, broadcast_id)
+    return broadcast_id
+
+
+async def resume_broadcasts(application):
+    """
+    Возобновляет рассылки, прерванные остановкой бота. Вызывается при запуске приложения.
+    """
+    for broadcast_id in await get_running_broadcast_ids():
+        if broadcast_id not in _running:
+            logger.info(f'Возобновление рассылки #{broadcast_id}')
+            _start_task(application, broadcast_id)
+
+
+async def stop_broadcasts(application):
+    """
+    Отменяет активные рассылки при остановке бота. Прогресс сохраняется после каждой страницы,
+    поэтому при следующем запуске рассылки продолжатся с последней сохраненной позиции.
+    """
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def format_broadcast_status(broadcast: dict) -> str:
+    """
+    Форматирует строку статуса рассылки для админ-панели.
+    """
+    processed = broadcast['sent'] + broadcast['failed']
+    total = max(broadcast['total'], processed)
+    percent = processed * 100 // total if total else 100
+    statuses = {'running': '⏳ идет', 'done': '✅ завершена', 'failed': '❌ ошибка'}
+    status = statuses.get(broadcast['status'], broadcast['status'])
+    return (f"#{broadcast['id']} {status}: {processed}/{total} ({percent}%), "
+            f"доставлено {broadcast['sent']}, не доставлено {broadcast['failed']}")
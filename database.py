@@ -1,13 +1,354 @@
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from leaderboard import Leaderboard
+from leveling import level_curve
+from writer import GroupCommitWriter, Abort
+from money import CENTS_PER_COIN
+
+# Параметры пула соединений с базой данных
+DB_PATH = os.getenv('DB_PATH', 'vapelume.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+# Профиль хранилища: PRAGMA, которые применяются к каждому соединению.
+# WAL позволяет читателям (WebApp) не ждать записи бота и наоборот.
+STORAGE_PROFILE = {
+    'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000')),
+    'journal_mode': os.getenv('DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024))),
+    'cache_size': int(os.getenv('DB_CACHE_SIZE', '-16000')),  # Отрицательное значение - размер в КиБ
+    'temp_store': os.getenv('DB_TEMP_STORE', 'MEMORY'),
+    'journal_size_limit': int(os.getenv('DB_JOURNAL_SIZE_LIMIT', str(64 * 1024 * 1024))),
+}
+
+# Интервал (в секундах) и режим периодического чекпоинта WAL
+DB_CHECKPOINT_INTERVAL = int(os.getenv('DB_CHECKPOINT_INTERVAL', '300'))
+DB_CHECKPOINT_MODE = os.getenv('DB_CHECKPOINT_MODE', 'PASSIVE')
+
+# Балансы хранятся в целых сотых долях монеты (см. money.py).
+# Начальный баланс нового пользователя - 100 монет
+DEFAULT_BALANCE = 100 * CENTS_PER_COIN
+
+# Кэш таблицы settings: загружается при старте и обновляется при записи настроек
+_settings_cache = None
+_settings_lock = threading.Lock()
+
+# Кэш ID администраторов (frozenset), обновляется при добавлении/удалении админа
+_admin_ids_cache = None
+
+# Буфер активности: время последнего сообщения по пользователям, еще не записанное в базу
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '30'))
+_pending_interactions = {}
+_interactions_lock = threading.Lock()
+
+# Таблица лидеров по балансу в памяти; обновляется при каждом изменении баланса
+LEADERBOARD_RELOAD_INTERVAL = int(os.getenv('LEADERBOARD_RELOAD_INTERVAL', '300'))
+_leaderboard = Leaderboard()
+
+# Журнал операций с монетами: допустимые причины, интервал снимков балансов
+# и срок, после которого покрытые снимками записи журнала удаляются
+LEDGER_REASONS = frozenset({
+    'bet', 'win', 'pay', 'give', 'burn', 'case', 'title', 'vpn', 'discount', 'referral', 'admin', 'other'
+})
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv('LEDGER_SNAPSHOT_INTERVAL', '3600'))
+LEDGER_RETENTION_DAYS = int(os.getenv('LEDGER_RETENTION_DAYS', '90'))
+LEDGER_COMPACT_BATCH = 5000  # Записей журнала, удаляемых за одну транзакцию
+
+
+def apply_storage_profile(conn: sqlite3.Connection, profile: dict = None):
+    """
+    Применяет к соединению настройки PRAGMA из профиля хранилища.
+    """
+    profile = STORAGE_PROFILE if profile is None else profile
+
+    # busy_timeout ставим первым, чтобы переключение journal_mode могло дождаться блокировки
+    if 'busy_timeout' in profile:
+        conn.execute(f'PRAGMA busy_timeout = {int(profile["busy_timeout"])}')
+    for pragma, value in profile.items():
+        if pragma == 'busy_timeout' or value is None:
+            continue
+        conn.execute(f'PRAGMA {pragma} = {value}')
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул долгоживущих соединений с SQLite.
+    Соединения создаются лениво (не больше size) и переиспользуются между вызовами,
+    поэтому открытие файла и разбор схемы происходят один раз на соединение.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired_total = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """
+        Открывает новое соединение и применяет к нему настройки PRAGMA.
+        """
+        conn = sqlite3.connect(self.path, timeout=STORAGE_PROFILE['busy_timeout'] / 1000, check_same_thread=False)
+        apply_storage_profile(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Выдает свободное соединение из пула. Если все соединения заняты и лимит исчерпан,
+        ждет освобождения не дольше timeout секунд.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is None:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # Пул исчерпан - ждем, пока другой поток вернет соединение
+                started = time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._waits += 1
+                        self._timeouts += 1
+                        self._wait_time += time.monotonic() - started
+                    raise sqlite3.OperationalError('Пул соединений с базой данных исчерпан')
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time += time.monotonic() - started
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired_total += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        """
+        Возвращает соединение в пул. Незавершенная транзакция откатывается,
+        а сломанное соединение закрывается и не возвращается в оборот.
+        """
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+
+        with self._lock:
+            self._in_use -= 1
+            if broken:
+                self._created -= 1
+                self._discarded += 1
+
+        if broken:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Контекстный менеджер: выдает соединение и гарантированно возвращает его в пул.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close_all(self):
+        """
+        Закрывает все простаивающие соединения (например, при остановке бота).
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        """
+        Возвращает статистику пула: размер, занятость и ожидания соединений.
+        """
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'peak_in_use': self._peak_in_use,
+                'acquired_total': self._acquired_total,
+                'waits': self._waits,
+                'avg_wait_ms': (self._wait_time / self._waits * 1000) if self._waits else 0.0,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'saturated': self._in_use >= self.size,
+            }
+
+
+_pool = ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+# Частые мелкие записи идут через единственный поток записи с групповым COMMIT,
+# чтобы не конкурировать за блокировку SQLite и не делать fsync на каждую запись
+_writer = GroupCommitWriter(_pool._create_connection)
+
+
+def _execute_op(cursor: sqlite3.Cursor, sql: str, params: tuple = ()):
+    """
+    Операция потока записи: одна команда SQL.
+    """
+    cursor.execute(sql, params)
+
+
+def _executemany_op(cursor: sqlite3.Cursor, sql: str, rows: list):
+    """
+    Операция потока записи: одна команда SQL для набора строк.
+    """
+    cursor.executemany(sql, rows)
+
+
+def get_connection():
+    """
+    Возвращает контекстный менеджер с соединением из общего пула.
+    """
+    return _pool.connection()
+
+
+def get_pool_stats() -> dict:
+    """
+    Возвращает статистику пула соединений и потока записи (ключ 'writer').
+    """
+    stats = _pool.stats()
+    stats['writer'] = _writer.stats()
+    return stats
+
+
+def close_database():
+    """
+    Дожидается записи поставленных операций и закрывает соединения пула.
+    """
+    _writer.stop()
+    _pool.close_all()
+
+
+def checkpoint_wal(mode: str = None) -> tuple[int, int, int]:
+    """
+    Переносит содержимое WAL-файла в основную базу, чтобы он не рос бесконечно.
+    Возвращает кортеж (busy, log_frames, checkpointed_frames).
+    """
+    mode = (mode or DB_CHECKPOINT_MODE).upper()
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f'Неизвестный режим чекпоинта: {mode}')
+
+    with get_connection() as conn:
+        result = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+    return tuple(result) if result else (0, 0, 0)
+
 
 def initialize_database():
     """
-    Инициализирует базу данных и создает необходимые таблицы.
+    Инициализирует базу данных: применяет недостающие миграции схемы
+    и загружает кэши настроек и администраторов.
+    """
+    with get_connection() as conn:
+        migrate(conn)
+    
+    # Загружаем настройки и список администраторов в память
+    load_settings_cache()
+    _load_admin_ids()
+
+
+def migrate(conn) -> int:
+    """
+    Применяет по порядку миграции, номер которых больше PRAGMA user_version.
+    Каждая миграция выполняется в отдельной транзакции BEGIN IMMEDIATE вместе с
+    обновлением user_version, поэтому параллельный запуск бота и API безопасен.
+    Если схема актуальна, DDL не выполняется. Возвращает итоговую версию схемы.
     """
-    conn = sqlite3.connect('vapelume.db')
     cursor = conn.cursor()
+    
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return version
+    
+    for target, migration in enumerate(MIGRATIONS, start=1):
+        if target <= version:
+            continue
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Версию перечитываем под блокировкой: другой процесс мог уже применить миграцию
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            if target > version:
+                migration(cursor)
+                # PRAGMA не поддерживает параметры, target - число из enumerate
+                cursor.execute(f'PRAGMA user_version = {target}')
+                version = target
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    return version
+
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """
+    Добавляет колонку в таблицу, если ее там еще нет.
+    ALTER TABLE ... ADD COLUMN в SQLite не переписывает таблицу, поэтому безопасен на живой базе.
+    """
+    columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
 
+def _migration_1_base_schema(cursor):
+    """
+    Миграция 1: базовые таблицы. IF NOT EXISTS позволяет применить ее к базам,
+    созданным до появления версионирования схемы.
+    """
     # Создание таблиц
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -70,97 +411,599 @@ def initialize_database():
         )
     ''')
 
-    conn.commit()
-    conn.close()
+    # Колонки, которых может не быть в старых базах
+    _add_column(cursor, 'users', 'last_bonus', 'TIMESTAMP')
+    _add_column(cursor, 'users', 'discount_tier', 'INTEGER DEFAULT 0')
 
 
-def get_user_balance(user_id: int) -> float:
+def _migration_2_indexes(cursor):
     """
-    Возвращает баланс пользователя. Если пользователя нет в таблице users,
-    создает его с балансом по умолчанию (100.0) и возвращает это значение.
+    Миграция 2: вторичные индексы для часто используемых выборок.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    # Подсчет приглашенных пользователей (get_referral_count)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer_id ON referrals (referrer_id)')
+    
+    # Поиск свободного промокода (get_available_vpn_code): индексируются только неиспользованные коды
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vpn_codes_available ON vpn_codes (type)
+        WHERE used_by IS NULL AND used_at IS NULL
+    ''')
+    
+    # Поиск истекших титулов (get_expired_titles)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_temp_titles_expires_at ON temp_titles (expires_at)')
+    
+    # Топ по балансу (get_top_users_by_balance) без сортировки всей таблицы
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC)')
     
-    # Проверяем, существует ли пользователь
+    # Выборки по времени последней активности (get_active_users_today_count, get_inactive_users)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_interactions_last_message ON interactions (last_message)')
+    
+    # Перед созданием уникального индекса удаляем дубликаты достижений, оставляя первую запись
+    cursor.execute('''
+        DELETE FROM achievements WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM achievements GROUP BY user_id, achievement_id
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_achievement
+        ON achievements (user_id, achievement_id)
+    ''')
+
+
+def _migration_3_bans(cursor):
+    """
+    Миграция 3: таблица заблокированных пользователей (раньше создавалась в ban_user).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bans (user_id INTEGER PRIMARY KEY, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+    ''')
+
+
+def _migration_4_users_meta(cursor):
+    """
+    Миграция 4: отображаемые имена пользователей для кэша identity.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users_meta (user_id INTEGER PRIMARY KEY, display_name TEXT, updated_at TIMESTAMP)
+    ''')
+
+
+def _migration_5_broadcasts(cursor):
+    """
+    Миграция 5: рассылки с сохраняемым прогрессом (для возобновления после перезапуска).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY,
+            text TEXT,
+            admin_chat_id INTEGER,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)')
+
+
+def _migration_6_reminders(cursor):
+    """
+    Миграция 6: время последнего напоминания пользователю, чтобы не напоминать повторно.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminders (user_id INTEGER PRIMARY KEY, reminded_at TIMESTAMP)
+    ''')
+
+
+def _migration_7_pending_deletions(cursor):
+    """
+    Миграция 7: очередь отложенного удаления сообщений (переживает перезапуск бота).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pending_deletions (
+            chat_id INTEGER,
+            message_id INTEGER,
+            due_at REAL,
+            PRIMARY KEY (chat_id, message_id)
+        )
+    ''')
+
+
+def _migration_8_ledger(cursor):
+    """
+    Миграция 8: журнал операций с монетами (только добавление) и снимки балансов.
+    Текущие балансы существующих пользователей становятся их начальными снимками.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta REAL NOT NULL,
+            balance_after REAL NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_created_at ON ledger(created_at)')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER PRIMARY KEY,
+            balance REAL NOT NULL,
+            ledger_id INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO balance_snapshots (user_id, balance, ledger_id, created_at)
+        SELECT user_id, balance, 0, ? FROM users
+    ''', (datetime.now(),))
+
+
+def _migration_9_integer_balances(cursor):
+    """
+    Миграция 9: балансы и суммы журнала переводятся из REAL (монеты) в INTEGER (сотые доли монеты).
+    SQLite не меняет тип столбца, поэтому таблицы пересоздаются с переносом данных.
+    """
+    cursor.execute('''
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 10000,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            last_bonus TIMESTAMP,
+            discount_tier INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO users_new (user_id, balance, xp, level, last_bonus, discount_tier)
+        SELECT user_id, CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER), xp, level, last_bonus, discount_tier
+        FROM users
+    ''')
+    cursor.execute('DROP TABLE users')
+    cursor.execute('ALTER TABLE users_new RENAME TO users')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC)')
+    
+    cursor.execute('''
+        CREATE TABLE ledger_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            balance_after INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO ledger_new (id, user_id, delta, balance_after, reason, created_at)
+        SELECT id, user_id, CAST(ROUND(delta * 100) AS INTEGER), CAST(ROUND(balance_after * 100) AS INTEGER),
+               reason, created_at
+        FROM ledger
+    ''')
+    cursor.execute('DROP TABLE ledger')
+    cursor.execute('ALTER TABLE ledger_new RENAME TO ledger')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_created_at ON ledger(created_at)')
+    
+    cursor.execute('''
+        CREATE TABLE balance_snapshots_new (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL,
+            ledger_id INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO balance_snapshots_new (user_id, balance, ledger_id, created_at)
+        SELECT user_id, CAST(ROUND(balance * 100) AS INTEGER), ledger_id, created_at FROM balance_snapshots
+    ''')
+    cursor.execute('DROP TABLE balance_snapshots')
+    cursor.execute('ALTER TABLE balance_snapshots_new RENAME TO balance_snapshots')
+
+
+def _migration_10_transfers(cursor):
+    """
+    Миграция 10: проведенные переводы между пользователями с ключами идемпотентности,
+    чтобы повторно доставленное обновление не провело перевод дважды.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transfers (
+            idempotency_key TEXT PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            sender_balance INTEGER NOT NULL,
+            recipient_balance INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+
+# Миграции схемы по порядку: номер версии = позиция в списке (начиная с 1).
+# Новые миграции добавляются только в конец, уже выпущенные не изменяются.
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_indexes,
+    _migration_3_bans,
+    _migration_4_users_meta,
+    _migration_5_broadcasts,
+    _migration_6_reminders,
+    _migration_7_pending_deletions,
+    _migration_8_ledger,
+    _migration_9_integer_balances,
+    _migration_10_transfers,
+]
+
+
+def get_user_balance(user_id: int) -> int:
+    """
+    Возвращает баланс пользователя в сотых долях монеты. Если пользователя нет в таблице users,
+    создает его с балансом по умолчанию (100 монет) и возвращает это значение.
+    """
+    return _get_or_create_user(user_id, 'balance')[0]
+
+
+def _get_or_create_user(user_id: int, columns: str) -> tuple:
+    """
+    Возвращает значения колонок columns пользователя. Если пользователя нет,
+    он создается через поток записи с балансом по умолчанию.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT {columns} FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+    
+    if result is not None:
+        return result
+    
+    created, result = _writer.execute(_create_user_op, user_id, columns)
+    if created:
+        _leaderboard.update(user_id, DEFAULT_BALANCE)
+    return result
+
+
+def _create_user_op(cursor: sqlite3.Cursor, user_id: int, columns: str) -> tuple[bool, tuple]:
+    """
+    Операция потока записи для _get_or_create_user(): создает пользователя, если его еще нет.
+    Возвращает (создан ли пользователь, значения колонок columns).
+    """
+    cursor.execute('INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)', (user_id, DEFAULT_BALANCE))
+    created = cursor.rowcount == 1
+    
+    cursor.execute(f'SELECT {columns} FROM users WHERE user_id = ?', (user_id,))
+    return created, cursor.fetchone()
+
+
+def adjust_balance(user_id: int, delta: int, floor: int = 0, reason: str = 'other') -> int:
+    """
+    Атомарно изменяет баланс пользователя на delta одной командой UPSERT ... RETURNING
+    и возвращает новый баланс. Суммы - в сотых долях монеты, баланс не опускается ниже floor.
+    Если пользователя нет, он создается с балансом по умолчанию (100 монет).
+    Фактическое изменение записывается в журнал с причиной reason в той же транзакции.
+    """
+    _check_reason(reason)
+    new_balance = _writer.execute(_adjust_balance_op, user_id, delta, floor, reason)
+    _leaderboard.update(user_id, new_balance)
+    return new_balance
+
+
+def _adjust_balance_op(cursor: sqlite3.Cursor, user_id: int, delta: int, floor: int, reason: str) -> int:
+    """
+    Операция потока записи для adjust_balance().
+    """
+    old_balance = _current_balance(cursor, user_id)
+    
+    # Вставка нового пользователя или изменение баланса существующего - одной командой,
+    # поэтому параллельные изменения из бота и WebApp не теряют друг друга
+    cursor.execute('''
+        INSERT INTO users (user_id, balance) VALUES (?, MAX(? + ?, ?))
+        ON CONFLICT(user_id) DO UPDATE SET balance = MAX(balance + ?, ?)
+        RETURNING balance
+    ''', (user_id, DEFAULT_BALANCE, delta, floor, delta, floor))
+    new_balance = cursor.fetchone()[0]
+    
+    _record_ledger(cursor, user_id, new_balance - old_balance, new_balance, reason)
+    return new_balance
+
+
+def _current_balance(cursor: sqlite3.Cursor, user_id: int) -> int:
+    """
+    Возвращает баланс пользователя внутри открытой транзакции
+    (баланс по умолчанию, если пользователя еще нет).
+    """
     cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
-    
+    return result[0] if result else DEFAULT_BALANCE
+
+
+def _check_reason(reason: str):
+    """
+    Проверяет, что причина операции входит в LEDGER_REASONS.
+    """
+    if reason not in LEDGER_REASONS:
+        raise ValueError(f'Неизвестная причина операции с монетами: {reason}')
+
+
+def _record_ledger(cursor: sqlite3.Cursor, user_id: int, delta: int, balance_after: int, reason: str):
+    """
+    Добавляет запись в журнал операций в рамках уже открытой транзакции.
+    Нулевые изменения не записываются.
+    """
+    if delta:
+        cursor.execute('''
+            INSERT INTO ledger (user_id, delta, balance_after, reason, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, delta, balance_after, reason, datetime.now()))
+
+
+def update_user_balance(user_id: int, amount: int, reason: str = 'other') -> int:
+    """
+    Изменяет баланс пользователя на указанную сумму в сотых долях монеты (может быть положительной или отрицательной).
+    Баланс не может стать отрицательным. Возвращает новый баланс.
+    """
+    return adjust_balance(user_id, amount, reason=reason)
+
+
+def debit_if_sufficient(user_id: int, amount: int, reason: str = 'other') -> int | None:
+    """
+    Списывает amount сотых долей монеты одной операцией потока записи, только если
+    на балансе хватает средств. Возвращает новый баланс или None, если средств недостаточно.
+    В отличие от adjust_balance(), баланс не обнуляется при нехватке, а списание не проводится.
+    """
+    if amount < 0:
+        raise ValueError('Сумма списания не может быть отрицательной')
+    _check_reason(reason)
+
+    new_balance = _writer.execute(_debit_if_sufficient_op, user_id, amount, reason)
+    if new_balance is None:
+        return None
+
+    _leaderboard.update(user_id, new_balance)
+    return new_balance
+
+
+def _debit_if_sufficient_op(cursor: sqlite3.Cursor, user_id: int, amount: int, reason: str) -> int:
+    """
+    Операция потока записи для debit_if_sufficient().
+    """
+    cursor.execute('INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)', (user_id, DEFAULT_BALANCE))
+    cursor.execute('''
+        UPDATE users SET balance = balance - ?
+        WHERE user_id = ? AND balance >= ?
+        RETURNING balance
+    ''', (amount, user_id, amount))
+    result = cursor.fetchone()
+
     if result is None:
-        # Пользователь не существует, создаем его с балансом по умолчанию
-        default_balance = 100.0
-        cursor.execute('INSERT INTO users (user_id, balance) VALUES (?, ?)', (user_id, default_balance))
-        conn.commit()
-        balance = default_balance
-    else:
-        balance = result[0]
+        # Недостаточно средств - откатываем операцию, включая создание пользователя
+        raise Abort(None)
+
+    new_balance = result[0]
+    _record_ledger(cursor, user_id, -amount, new_balance, reason)
+    return new_balance
+
+
+def settle_round(user_id: int, bet: int, payout: int) -> int | None:
+    """
+    Проводит игровой раунд одной операцией потока записи: проверяет, что на балансе
+    хватает средств на ставку, списывает ставку и начисляет выигрыш (суммы в сотых долях монеты).
+    Отрицательный payout означает штраф: баланс при этом не опускается ниже нуля.
+    Возвращает итоговый баланс или None, если средств на ставку недостаточно.
+    В журнал записываются ставка (bet) и выигрыш (win) или штраф (bet).
+    """
+    new_balance = _writer.execute(_settle_round_op, user_id, bet, payout)
+    if new_balance is None:
+        return None
     
-    conn.close()
-    return balance
+    _leaderboard.update(user_id, new_balance)
+    return new_balance
 
 
-def update_user_balance(user_id: int, amount: float):
+def _settle_round_op(cursor: sqlite3.Cursor, user_id: int, bet: int, payout: int) -> int:
     """
-    Изменяет баланс пользователя на указанную сумму (может быть положительной или отрицательной).
-    Убедись, что баланс не может стать отрицательным.
+    Операция потока записи для settle_round().
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    cursor.execute('INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)', (user_id, DEFAULT_BALANCE))
+    old_balance = _current_balance(cursor, user_id)
     
-    # Получаем текущий баланс
-    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+    # Списание ставки и начисление выигрыша одной командой, только если хватает средств
+    cursor.execute('''
+        UPDATE users SET balance = MAX(balance - ? + ?, 0)
+        WHERE user_id = ? AND balance >= ?
+        RETURNING balance
+    ''', (bet, payout, user_id, bet))
     result = cursor.fetchone()
     
     if result is None:
-        # Если пользователя нет, создаем его с балансом по умолчанию
-        current_balance = 100.0
-        cursor.execute('INSERT INTO users (user_id, balance) VALUES (?, ?)', (user_id, current_balance))
-    else:
-        current_balance = result[0]
+        # Недостаточно средств - откатываем операцию, включая создание пользователя
+        raise Abort(None)
     
-    # Рассчитываем новый баланс
-    new_balance = current_balance + amount
-    
-    # Убедимся, что баланс не станет отрицательным
-    if new_balance < 0:
-        new_balance = 0
+    new_balance = result[0]
+    _record_ledger(cursor, user_id, -bet, old_balance - bet, 'bet')
+    result_delta = new_balance - (old_balance - bet)
+    _record_ledger(cursor, user_id, result_delta, new_balance, 'win' if result_delta > 0 else 'bet')
+    return new_balance
+
+
+def settle_penalty(user_id: int, amount: int) -> tuple[int, int]:
+    """
+    Списывает штраф amount сотых долей монеты одной операцией потока записи.
+    Если на балансе меньше штрафа, списывается весь баланс.
+    Возвращает (фактически списанная сумма, итоговый баланс).
+    """
+    charged, new_balance = _writer.execute(_settle_penalty_op, user_id, amount)
+    _leaderboard.update(user_id, new_balance)
+    return charged, new_balance
+
+
+def _settle_penalty_op(cursor: sqlite3.Cursor, user_id: int, amount: int) -> tuple[int, int]:
+    """
+    Операция потока записи для settle_penalty().
+    """
+    # Баланс до списания читается в той же транзакции, что и списание
+    old_balance = _current_balance(cursor, user_id)
+    new_balance = _adjust_balance_op(cursor, user_id, -amount, 0, 'bet')
+    return old_balance - new_balance, new_balance
+
+
+def transfer(sender_id: int, recipient_id: int, amount: int, idempotency_key: str | None = None) -> tuple[int, int] | None:
+    """
+    Переводит amount сотых долей монеты от sender_id к recipient_id одной транзакцией:
+    списание выполняется, только если у отправителя хватает средств.
+    Возвращает (баланс отправителя, баланс получателя) или None, если средств недостаточно.
+    Повторный вызов с тем же idempotency_key не проводит перевод снова,
+    а возвращает балансы, сохраненные при первом проведении.
+    """
+    if amount <= 0:
+        raise ValueError('Сумма перевода должна быть больше 0')
+    if sender_id == recipient_id:
+        raise ValueError('Нельзя перевести средства самому себе')
     
-    # Обновляем баланс
-    cursor.execute('UPDATE users SET balance = ? WHERE user_id = ?', (new_balance, user_id))
+    result = _writer.execute(_transfer_op, sender_id, recipient_id, amount, idempotency_key)
+    if result is None:
+        return None
     
-    conn.commit()
-    conn.close()
+    sender_balance, recipient_balance = result
+    _leaderboard.update(sender_id, sender_balance)
+    _leaderboard.update(recipient_id, recipient_balance)
+    return result
 
 
-def get_top_users_by_balance(limit: int = 10) -> list[tuple[int, float]]:
+def _transfer_op(cursor: sqlite3.Cursor, sender_id: int, recipient_id: int, amount: int,
+                 idempotency_key: str | None) -> tuple[int, int]:
     """
-    Возвращает список кортежей (user_id, balance), отсортированный по убыванию баланса.
+    Операция потока записи для transfer().
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    if idempotency_key is not None:
+        cursor.execute('SELECT sender_balance, recipient_balance FROM transfers WHERE idempotency_key = ?',
+                      (idempotency_key,))
+        done = cursor.fetchone()
+        if done is not None:
+            # Перевод уже проведен - возвращаем его результат
+            return done
+    
+    cursor.execute('INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)', (sender_id, DEFAULT_BALANCE))
+    cursor.execute('''
+        UPDATE users SET balance = balance - ?
+        WHERE user_id = ? AND balance >= ?
+        RETURNING balance
+    ''', (amount, sender_id, amount))
+    debit = cursor.fetchone()
     
-    cursor.execute('SELECT user_id, balance FROM users ORDER BY balance DESC LIMIT ?', (limit,))
-    results = cursor.fetchall()
+    if debit is None:
+        # Недостаточно средств - откатываем операцию, включая создание пользователя
+        raise Abort(None)
+    
+    cursor.execute('''
+        INSERT INTO users (user_id, balance) VALUES (?, ? + ?)
+        ON CONFLICT(user_id) DO UPDATE SET balance = balance + ?
+        RETURNING balance
+    ''', (recipient_id, DEFAULT_BALANCE, amount, amount))
+    credit = cursor.fetchone()
     
-    conn.close()
+    sender_balance, recipient_balance = debit[0], credit[0]
+    _record_ledger(cursor, sender_id, -amount, sender_balance, 'pay')
+    _record_ledger(cursor, recipient_id, amount, recipient_balance, 'pay')
+    
+    if idempotency_key is not None:
+        cursor.execute('''
+            INSERT INTO transfers (idempotency_key, sender_id, recipient_id, amount,
+                                   sender_balance, recipient_balance, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, sender_id, recipient_id, amount, sender_balance, recipient_balance, datetime.now()))
+    
+    return sender_balance, recipient_balance
+
+
+def _query_top_users(limit: int) -> list[tuple[int, int]]:
+    """
+    Выбирает из базы limit пользователей с наибольшим балансом (по индексу idx_users_balance).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id, balance FROM users ORDER BY balance DESC LIMIT ?', (limit,))
+        results = cursor.fetchall()
     
     return results
 
 
-def get_bound_supergroup_id() -> int | None:
+def reload_leaderboard():
     """
-    Извлекает chat_id из таблицы settings по ключу bound_supergroup_id.
+    Перезагружает таблицу лидеров из базы. Нужна, чтобы учесть изменения,
+    сделанные другими процессами (например, веб-API). Выборка и замена таблицы
+    выполняются под блокировкой таблицы, поэтому параллельные изменения баланса не теряются.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    _leaderboard.reload(_query_top_users)
+
+
+def get_top_users_by_balance(limit: int = 10) -> list[tuple[int, int]]:
+    """
+    Возвращает список кортежей (user_id, balance), отсортированный по убыванию баланса.
+    Данные берутся из таблицы лидеров в памяти; к базе обращаемся, только если ее нужно перезагрузить.
+    """
+    if limit > _leaderboard.capacity:
+        return _query_top_users(limit)
     
-    cursor.execute('SELECT value FROM settings WHERE key = ?', ('bound_supergroup_id',))
-    result = cursor.fetchone()
+    top = _leaderboard.top(limit)
+    if top is None:
+        reload_leaderboard()
+        top = _leaderboard.top(limit)
+    
+    return top
+
+
+def load_settings_cache():
+    """
+    Загружает таблицу settings в память. Вызывается при старте,
+    после чего настройки читаются без обращения к базе.
+    """
+    global _settings_cache
     
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT key, value FROM settings')
+        results = cursor.fetchall()
     
-    if result:
-        return int(result[0])
+    with _settings_lock:
+        _settings_cache = dict(results)
+
+
+def _get_cached_setting(key: str, default_value: str = None) -> str | None:
+    """
+    Возвращает значение настройки из кэша (при первом обращении загружает кэш).
+    """
+    if _settings_cache is None:
+        load_settings_cache()
+    return _settings_cache.get(key, default_value)
+
+
+def _save_setting(key: str, value: str):
+    """
+    Сохраняет настройку в таблицу settings и обновляет кэш.
+    """
+    _writer.execute(_execute_op, 'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+    
+    with _settings_lock:
+        if _settings_cache is not None:
+            _settings_cache[key] = value
+
+
+def get_bound_supergroup_id() -> int | None:
+    """
+    Возвращает chat_id привязанной супергруппы (ключ bound_supergroup_id в settings).
+    Значение берется из кэша настроек.
+    """
+    value = _get_cached_setting('bound_supergroup_id')
+    
+    if value:
+        return int(value)
     return None
 
 
@@ -168,64 +1011,67 @@ def set_bound_supergroup_id(chat_id: int):
     """
     Сохраняет chat_id в таблицу settings.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    _save_setting('bound_supergroup_id', str(chat_id))
+
+
+def _load_admin_ids() -> frozenset[int]:
+    """
+    Загружает ID администраторов из таблицы admins в кэш.
+    """
+    global _admin_ids_cache
     
-    cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', ('bound_supergroup_id', str(chat_id)))
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id FROM admins')
+        results = cursor.fetchall()
     
-    conn.commit()
-    conn.close()
+    _admin_ids_cache = frozenset(row[0] for row in results)
+    return _admin_ids_cache
+
+
+def get_admin_ids() -> frozenset[int]:
+    """
+    Возвращает множество ID администраторов из кэша (проверка членства за O(1)).
+    """
+    admin_ids = _admin_ids_cache
+    if admin_ids is None:
+        admin_ids = _load_admin_ids()
+    return admin_ids
 
 
 def get_all_admin_ids() -> list[int]:
     """
-    Возвращает список ID всех администраторов из таблицы admins.
+    Возвращает список ID всех администраторов.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT user_id FROM admins')
-    results = cursor.fetchall()
-    
-    conn.close()
-    
-    return [row[0] for row in results]
+    return sorted(get_admin_ids())
 
 
 def add_admin(user_id: int):
     """
     Добавляет пользователя в таблицу администраторов.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
+    _writer.execute(_execute_op, 'INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
     
-    conn.commit()
-    conn.close()
+    # Обновляем кэш администраторов
+    _load_admin_ids()
 
 
 def remove_admin(user_id: int):
     """
     Удаляет пользователя из таблицы администраторов.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
+    _writer.execute(_execute_op, 'DELETE FROM admins WHERE user_id = ?', (user_id,))
     
-    conn.commit()
-    conn.close()
+    # Обновляем кэш администраторов
+    _load_admin_ids()
 
 
-def add_xp(user_id: int, amount: int) -> tuple[int, int]:
+def _apply_xp(cursor: sqlite3.Cursor, user_id: int, amount: int) -> tuple[int, int, int]:
     """
-    Начисляет опыт пользователю и проверяет повышение уровня.
-    Возвращает кортеж (new_level, new_xp).
+    Начисляет опыт в рамках уже открытой транзакции и проверяет повышение уровня.
+    Возвращает кортеж (old_level, new_level, new_xp).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Получаем текущий уровень и опыт
     cursor.execute('SELECT level, xp FROM users WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
@@ -236,89 +1082,72 @@ def add_xp(user_id: int, amount: int) -> tuple[int, int]:
         current_xp = 0
         cursor.execute('INSERT INTO users (user_id, level, xp) VALUES (?, ?, ?)',
                       (user_id, current_level, current_xp))
+        # Новый пользователь получает баланс по умолчанию
+        _leaderboard.update(user_id, DEFAULT_BALANCE)
     else:
         current_level, current_xp = result
     
-    # Добавляем опыт
-    new_xp = current_xp + amount
-    
-    # Проверяем, повысился ли уровень (каждые 500 XP)
-    new_level = current_level
-    while new_xp >= new_level * 500:  # Для усложнения уровня требуем больше XP
-        new_xp -= new_level * 500
-        new_level += 1
+    # Пересчитываем уровень по кривой за O(1), независимо от количества опыта
+    new_level, new_xp = level_curve.apply(current_level, current_xp, amount)
     
     # Обновляем уровень и опыт в БД
     cursor.execute('UPDATE users SET level = ?, xp = ? WHERE user_id = ?',
                   (new_level, new_xp, user_id))
     
-    conn.commit()
-    conn.close()
-    
+    return current_level, new_level, new_xp
+
+
+def add_xp(user_id: int, amount: int) -> tuple[int, int]:
+    """
+    Начисляет опыт пользователю и проверяет повышение уровня.
+    Возвращает кортеж (new_level, new_xp).
+    """
+    _, new_level, new_xp = _writer.execute(_apply_xp, user_id, amount)
     return new_level, new_xp
 
 
+def add_xp_batch(amounts: dict[int, int]) -> dict[int, tuple[int, int, int]]:
+    """
+    Начисляет опыт сразу нескольким пользователям одной транзакцией.
+    Принимает словарь {user_id: amount}, возвращает {user_id: (old_level, new_level, new_xp)}.
+    """
+    return _writer.execute(_apply_xp_batch, amounts)
+
+
+def _apply_xp_batch(cursor: sqlite3.Cursor, amounts: dict[int, int]) -> dict[int, tuple[int, int, int]]:
+    """
+    Операция потока записи для add_xp_batch().
+    """
+    return {user_id: _apply_xp(cursor, user_id, amount) for user_id, amount in amounts.items()}
+
+
 def get_user_profile(user_id: int) -> tuple[int, int, int]:
     """
-    Возвращает кортеж с данными профиля (level, xp, balance).
+    Возвращает кортеж с данными профиля (level, xp, balance), баланс - в сотых долях монеты.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT level, xp, balance FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    if result is None:
-        # Если пользователя нет, создаем его с начальными значениями
-        default_level = 1
-        default_xp = 0
-        default_balance = 100.0
-        cursor.execute('INSERT INTO users (user_id, level, xp, balance) VALUES (?, ?, ?, ?)',
-                      (user_id, default_level, default_xp, default_balance))
-        conn.commit()
-        profile = (default_level, default_xp, int(default_balance))
-    else:
-        # balance хранится как REAL, преобразуем в int для возврата
-        level, xp, balance = result
-        profile = (level, xp, int(balance))
-    
-    conn.close()
-    return profile
+    # Новый пользователь создается с начальными значениями (уровень 1, 0 опыта)
+    return _get_or_create_user(user_id, 'level, xp, balance')
 
 
 def grant_achievement(user_id: int, achievement_id: str):
     """
     Присваивает пользователю достижение.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Проверяем, есть ли уже такое достижение у пользователя
-    cursor.execute('SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?',
-                  (user_id, achievement_id))
-    result = cursor.fetchone()
-    
-    if result is None:
-        # Если достижения нет, добавляем его
-        cursor.execute('INSERT INTO achievements (user_id, achievement_id, unlocked) VALUES (?, ?, ?)',
-                      (user_id, achievement_id, True))
-    
-    conn.commit()
-    conn.close()
+    # Уникальный индекс (user_id, achievement_id) не даст выдать достижение повторно
+    _writer.execute(_execute_op, 'INSERT OR IGNORE INTO achievements (user_id, achievement_id, unlocked) VALUES (?, ?, ?)',
+                    (user_id, achievement_id, True))
 
 
 def get_user_achievements(user_id: int) -> list[str]:
     """
     Возвращает список ID достижений пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT achievement_id FROM achievements WHERE user_id = ? AND unlocked = ?',
-                  (user_id, True))
-    results = cursor.fetchall()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT achievement_id FROM achievements WHERE user_id = ? AND unlocked = ?',
+                      (user_id, True))
+        results = cursor.fetchall()
     
     return [achievement_id for achievement_id, in results]
 
@@ -327,109 +1156,68 @@ def get_user_discount_tier(user_id: int) -> int:
     """
     Возвращает уровень скидки пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT discount_tier FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    if result is None:
-        # Если пользователя нет, создаем его с уровнем скидки по умолчанию (0)
-        default_discount_tier = 0
-        cursor.execute('INSERT INTO users (user_id, discount_tier) VALUES (?, ?)', (user_id, default_discount_tier))
-        conn.commit()
-        discount_tier = default_discount_tier
-    else:
-        discount_tier = result[0]
-    
-    conn.close()
-    return discount_tier
+    # Новый пользователь создается с уровнем скидки по умолчанию (0)
+    return _get_or_create_user(user_id, 'discount_tier')[0]
 
 
 def set_user_discount_tier(user_id: int, tier: int):
     """
     Устанавливает уровень скидки пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Обновляем уровень скидки
-    cursor.execute('UPDATE users SET discount_tier = ? WHERE user_id = ?', (tier, user_id))
-    
-    conn.commit()
-    conn.close()
+    _writer.execute(_execute_op, 'UPDATE users SET discount_tier = ? WHERE user_id = ?', (tier, user_id))
 
 
-def get_available_vpn_code(code_type: str) -> str | None:
+def get_available_vpn_code(code_type: str, user_id: int) -> str | None:
     """
     Находит один неиспользованный промокод указанного типа, помечает его как использованный
-    (записывая user_id и used_at) и возвращает код.
+    пользователем user_id и возвращает код (None, если свободных промокодов нет).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Находим неиспользованный промокод указанного типа
-    cursor.execute('SELECT id, code FROM vpn_codes WHERE type = ? AND used_by IS NULL AND used_at IS NULL LIMIT 1', (code_type,))
+    return _writer.execute(_claim_vpn_code_op, code_type, user_id)
+
+
+def _claim_vpn_code_op(cursor: sqlite3.Cursor, code_type: str, user_id: int) -> str | None:
+    """
+    Операция потока записи для get_available_vpn_code().
+    """
+    # Выбор и пометка промокода - одна команда, поэтому два покупателя не получат один и тот же код
+    cursor.execute('''
+        UPDATE vpn_codes SET used_by = ?, used_at = ?
+        WHERE id = (SELECT id FROM vpn_codes WHERE type = ? AND used_by IS NULL AND used_at IS NULL LIMIT 1)
+        RETURNING code
+    ''', (user_id, datetime.now(), code_type))
     result = cursor.fetchone()
     
-    if result is None:
-        # Нет доступных промокодов
-        conn.close()
-        return None
-    
-    vpn_id, vpn_code = result
-    
-    # Помечаем промокод как использованный
-    cursor.execute('UPDATE vpn_codes SET used_by = ?, used_at = ? WHERE id = ?', (None, datetime.now(), vpn_id))
-    
-    conn.commit()
-    conn.close()
-    
-    return vpn_code
+    return result[0] if result else None
 
 
 def add_vpn_codes(codes: list[tuple[str, str]]):
     """
     Добавляет список промокодов в базу данных. Кортеж: (code, type).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Добавляем промокоды в базу данных
-    for code, code_type in codes:
-        cursor.execute('INSERT OR IGNORE INTO vpn_codes (code, type) VALUES (?, ?)', (code, code_type))
-    
-    conn.commit()
-    conn.close()
+    _writer.execute(_executemany_op, 'INSERT OR IGNORE INTO vpn_codes (code, type) VALUES (?, ?)', codes)
 
 
 def add_referral(user_id: int, referrer_id: int):
     """
     Добавляет запись о реферале в базу данных.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Добавляем запись о реферале
-    cursor.execute('INSERT OR REPLACE INTO referrals (user_id, referrer_id, reward_claimed) VALUES (?, ?, ?)',
-                  (user_id, referrer_id, False))
-    
-    conn.commit()
-    conn.close()
+    _writer.execute(_execute_op, 'INSERT OR REPLACE INTO referrals (user_id, referrer_id, reward_claimed) VALUES (?, ?, ?)',
+                    (user_id, referrer_id, False))
 
 
 def get_referrer_id(user_id: int) -> int | None:
     """
     Получает ID пригласившего пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Получаем referrer_id для пользователя
-    cursor.execute('SELECT referrer_id FROM referrals WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Получаем referrer_id для пользователя
+        cursor.execute('SELECT referrer_id FROM referrals WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
     if result:
         return result[0]
@@ -440,14 +1228,12 @@ def get_referral_count(user_id: int) -> int:
     """
     Считает, сколько пользователей пригласил данный пользователь.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Считаем количество приглашенных пользователей
-    cursor.execute('SELECT COUNT(*) FROM referrals WHERE referrer_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Считаем количество приглашенных пользователей
+        cursor.execute('SELECT COUNT(*) FROM referrals WHERE referrer_id = ?', (user_id,))
+        result = cursor.fetchone()
     
     return result[0] if result else 0
 
@@ -456,14 +1242,12 @@ def get_referral_reward_status(user_id: int) -> bool:
     """
     Проверяет, получил ли уже пользователь награду за реферала.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Проверяем статус получения награды
-    cursor.execute('SELECT reward_claimed FROM referrals WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Проверяем статус получения награды
+        cursor.execute('SELECT reward_claimed FROM referrals WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
     if result:
         return result[0] == 1
@@ -474,27 +1258,19 @@ def mark_referral_reward_as_claimed(user_id: int):
     """
     Помечает, что награда за приглашение была выдана.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Помечаем награду как полученную
-    cursor.execute('UPDATE referrals SET reward_claimed = ? WHERE user_id = ?', (True, user_id))
-    
-    conn.commit()
-    conn.close()
+    _writer.execute(_execute_op, 'UPDATE referrals SET reward_claimed = ? WHERE user_id = ?', (True, user_id))
 
 
 def get_total_users_count() -> int:
     """
     Возвращает общее количество пользователей в системе.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM users')
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*) FROM users')
+        result = cursor.fetchone()
     
     return result[0] if result else 0
 
@@ -503,171 +1279,402 @@ def get_active_users_today_count() -> int:
     """
     Возвращает количество активных пользователей сегодня.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Получаем количество пользователей, которые отправили сообщение сегодня
-    today = datetime.now().date()
-    cursor.execute('SELECT COUNT(*) FROM interactions WHERE date(last_message) = ?', (today,))
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Получаем количество пользователей, которые отправили сообщение сегодня.
+        # Сравнение по диапазону, а не через date(), позволяет использовать индекс по last_message
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        tomorrow_start = today_start + timedelta(days=1)
+        cursor.execute('SELECT COUNT(*) FROM interactions WHERE last_message >= ? AND last_message < ?',
+                      (today_start, tomorrow_start))
+        result = cursor.fetchone()
     
     return result[0] if result else 0
 
 
-def get_total_currency_in_system() -> float:
+def get_total_currency_in_system() -> int:
     """
-    Возвращает общую сумму LumeCoin в системе.
+    Возвращает общую сумму LumeCoin в системе в сотых долях монеты (сумма целых - точная).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT SUM(balance) FROM users')
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COALESCE(SUM(balance), 0) FROM users')
+        result = cursor.fetchone()
     
-    return result[0] if result and result[0] else 0.0
+    return result[0]
 
 
 def ban_user(user_id: int):
     """
     Добавляет пользователя в список заблокированных.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Создаем таблицу bans, если она не существует
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bans (user_id INTEGER PRIMARY KEY, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-    ''')
-    
     # Добавляем пользователя в таблицу банов
-    cursor.execute('INSERT OR REPLACE INTO bans (user_id) VALUES (?)', (user_id,))
-    
-    conn.commit()
-    conn.close()
+    _writer.execute(_execute_op, 'INSERT OR REPLACE INTO bans (user_id) VALUES (?)', (user_id,))
 
 
 def is_user_banned(user_id: int) -> bool:
     """
     Проверяет, заблокирован ли пользователь.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT 1 FROM bans WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
-    cursor.execute('SELECT 1 FROM bans WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+    return result is not None
+
+
+def get_user_ids_page(after_user_id: int = 0, limit: int = 500) -> list[int]:
+    """
+    Возвращает следующую страницу ID пользователей после after_user_id (по возрастанию).
+    Постраничная выборка по ключу не перечитывает уже пройденные строки.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                      (after_user_id, limit))
+        results = cursor.fetchall()
+    
+    return [row[0] for row in results]
+
+
+def create_broadcast(text: str, admin_chat_id: int) -> int:
+    """
+    Создает запись о рассылке и возвращает ее ID.
+    """
+    return _writer.execute(_create_broadcast_op, text, admin_chat_id)
+
+
+def _create_broadcast_op(cursor: sqlite3.Cursor, text: str, admin_chat_id: int) -> int:
+    """
+    Операция потока записи для create_broadcast().
+    """
+    now = datetime.now()
+    cursor.execute('''
+        INSERT INTO broadcasts (text, admin_chat_id, status, total, created_at, updated_at)
+        VALUES (?, ?, 'running', (SELECT COUNT(*) FROM users), ?, ?)
+    ''', (text, admin_chat_id, now, now))
+    return cursor.lastrowid
+
+
+def update_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int, status: str = 'running'):
+    """
+    Сохраняет прогресс рассылки: последний обработанный ID пользователя и счетчики.
+    """
+    _writer.execute(_execute_op, '''
+        UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, status = ?, updated_at = ?
+        WHERE id = ?
+    ''', (last_user_id, sent, failed, status, datetime.now(), broadcast_id))
+
+
+def _broadcast_from_row(row) -> dict:
+    """
+    Преобразует строку таблицы broadcasts в словарь.
+    """
+    broadcast_id, text, admin_chat_id, status, last_user_id, total, sent, failed = row
+    return {
+        'id': broadcast_id,
+        'text': text,
+        'admin_chat_id': admin_chat_id,
+        'status': status,
+        'last_user_id': last_user_id,
+        'total': total,
+        'sent': sent,
+        'failed': failed
+    }
+
+
+def get_broadcast(broadcast_id: int) -> dict | None:
+    """
+    Возвращает информацию о рассылке по ее ID.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, text, admin_chat_id, status, last_user_id, total, sent, failed
+            FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        result = cursor.fetchone()
     
-    conn.close()
+    return _broadcast_from_row(result) if result else None
+
+
+def get_recent_broadcasts(limit: int = 5) -> list[dict]:
+    """
+    Возвращает последние рассылки, начиная с самой новой.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, text, admin_chat_id, status, last_user_id, total, sent, failed
+            FROM broadcasts ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+        results = cursor.fetchall()
     
-    return result is not None
+    return [_broadcast_from_row(row) for row in results]
 
 
-def give_coins_to_all_users(amount: float):
+def get_running_broadcast_ids() -> list[int]:
     """
-    Выдает указанное количество монет всем пользователям.
+    Возвращает ID незавершенных рассылок (например, прерванных перезапуском бота).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        results = cursor.fetchall()
+    
+    return [row[0] for row in results]
+
+
+def save_pending_deletions(deletions: list[tuple[int, int, float]]):
+    """
+    Сохраняет сообщения, ожидающие удаления. Кортеж: (chat_id, message_id, due_at),
+    где due_at - время удаления в секундах эпохи Unix.
+    """
+    _writer.execute(_executemany_op, 'INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, due_at) VALUES (?, ?, ?)',
+                    deletions)
+
+
+def remove_pending_deletions(messages: list[tuple[int, int]]):
+    """
+    Убирает из очереди удаления обработанные сообщения. Кортеж: (chat_id, message_id).
+    """
+    _writer.execute(_executemany_op, 'DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?', messages)
+
+
+def get_pending_deletions() -> list[tuple[int, int, float]]:
+    """
+    Возвращает все сообщения, ожидающие удаления: (chat_id, message_id, due_at).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT chat_id, message_id, due_at FROM pending_deletions')
+        results = cursor.fetchall()
     
+    return results
+
+
+def give_coins_to_all_users(amount: int):
+    """
+    Выдает всем пользователям указанную сумму в сотых долях монеты.
+    """
+    _writer.execute(_give_coins_to_all_op, amount)
+    _leaderboard.shift_all(amount)
+
+
+def _give_coins_to_all_op(cursor: sqlite3.Cursor, amount: int):
+    """
+    Операция потока записи для give_coins_to_all_users().
+    """
     # Обновляем баланс всех пользователей, добавляя указанную сумму
     cursor.execute('UPDATE users SET balance = balance + ?', (amount,))
-    
-    conn.commit()
-    conn.close()
+    cursor.execute('''
+        INSERT INTO ledger (user_id, delta, balance_after, reason, created_at)
+        SELECT user_id, ?, balance, 'give', ? FROM users
+    ''', (amount, datetime.now()))
 
 
 def reset_user_balance(user_id: int):
     """
     Обнуляет баланс указанного пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    _writer.execute(_reset_user_balance_op, user_id)
+    _leaderboard.update(user_id, 0)
+
+
+def _reset_user_balance_op(cursor: sqlite3.Cursor, user_id: int):
+    """
+    Операция потока записи для reset_user_balance().
+    """
+    cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+    result = cursor.fetchone()
+    if result is None:
+        return
     
     # Обновляем баланс пользователя до 0
     cursor.execute('UPDATE users SET balance = 0 WHERE user_id = ?', (user_id,))
+    _record_ledger(cursor, user_id, -result[0], 0, 'admin')
+
+
+def _ledger_from_row(row) -> dict:
+    """
+    Преобразует строку таблицы ledger в словарь.
+    """
+    entry_id, user_id, delta, balance_after, reason, created_at = row
+    return {
+        'id': entry_id,
+        'user_id': user_id,
+        'delta': delta,
+        'balance_after': balance_after,
+        'reason': reason,
+        'created_at': datetime.fromisoformat(created_at)
+    }
+
+
+def get_ledger_entries(user_id: int | None = None, since: datetime = None, until: datetime = None,
+                       after_id: int = 0, limit: int = 100) -> list[dict]:
+    """
+    Возвращает записи журнала по возрастанию ID: для одного пользователя или для всех,
+    за период [since, until). Следующая страница - after_id = ID последней записи.
+    """
+    conditions = ['id > ?']
+    params = [after_id]
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if since is not None:
+        conditions.append('created_at >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('created_at < ?')
+        params.append(until)
     
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT id, user_id, delta, balance_after, reason, created_at FROM ledger
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id LIMIT ?
+        ''', (*params, limit))
+        rows = cursor.fetchall()
+    
+    return [_ledger_from_row(row) for row in rows]
 
 
-def get_game_setting(key: str, default_value: str = None) -> str:
+def replay_balance(user_id: int) -> int:
     """
-    Получает значение настройки игры из таблицы settings.
+    Восстанавливает баланс пользователя по журналу: последний снимок
+    (или баланс по умолчанию) плюс все изменения после него.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT balance, ledger_id FROM balance_snapshots WHERE user_id = ?', (user_id,))
+        snapshot = cursor.fetchone()
+        balance, ledger_id = snapshot if snapshot else (DEFAULT_BALANCE, 0)
+        
+        cursor.execute('SELECT COALESCE(SUM(delta), 0) FROM ledger WHERE user_id = ? AND id > ?',
+                      (user_id, ledger_id))
+        delta = cursor.fetchone()[0]
     
-    cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-    result = cursor.fetchone()
+    return balance + delta
+
+
+def snapshot_balances() -> int:
+    """
+    Обновляет снимки балансов пользователей, у которых появились записи в журнале
+    после прошлого снимка. Возвращает количество обновленных снимков.
+    """
+    return _writer.execute(_snapshot_balances_op)
+
+
+def _snapshot_balances_op(cursor: sqlite3.Cursor) -> int:
+    """
+    Операция потока записи для snapshot_balances().
+    """
+    cursor.execute('SELECT COALESCE(MAX(ledger_id), 0) FROM balance_snapshots')
+    last_ledger_id = cursor.fetchone()[0]
     
-    conn.close()
+    # Снимок - баланс после последней записи журнала каждого пользователя
+    cursor.execute('''
+        INSERT OR REPLACE INTO balance_snapshots (user_id, balance, ledger_id, created_at)
+        SELECT user_id, balance_after, id, ? FROM ledger
+        WHERE id IN (SELECT MAX(id) FROM ledger WHERE id > ? GROUP BY user_id)
+    ''', (datetime.now(), last_ledger_id))
+    return cursor.rowcount
+
+
+def compact_ledger(before: datetime) -> int:
+    """
+    Удаляет записи журнала старше before, уже учтенные в снимках балансов,
+    небольшими транзакциями. Возвращает количество удаленных записей.
+    """
+    deleted = 0
+    while True:
+        count = _writer.execute(_compact_ledger_op, before)
+        
+        deleted += count
+        if count < LEDGER_COMPACT_BATCH:
+            break
     
-    if result:
-        return result[0]
-    return default_value
+    return deleted
+
+
+def _compact_ledger_op(cursor: sqlite3.Cursor, before: datetime) -> int:
+    """
+    Операция потока записи для compact_ledger(): удаляет одну порцию записей журнала.
+    """
+    cursor.execute('''
+        DELETE FROM ledger WHERE id IN (
+            SELECT l.id FROM ledger l
+            JOIN balance_snapshots s ON s.user_id = l.user_id
+            WHERE l.created_at < ? AND l.id <= s.ledger_id
+            LIMIT ?
+        )
+    ''', (before, LEDGER_COMPACT_BATCH))
+    return cursor.rowcount
+
+
+def get_game_setting(key: str, default_value: str = None) -> str:
+    """
+    Получает значение настройки игры (из кэша таблицы settings).
+    """
+    return _get_cached_setting(key, default_value)
 
 
 def set_game_setting(key: str, value: str):
     """
     Устанавливает значение настройки игры в таблице settings.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
-    
-    conn.commit()
-    conn.close()
+    _save_setting(key, value)
 
 
 def get_all_user_ids() -> list[int]:
     """
-    Возвращает список всех ID пользователей в системе.
+    Возвращает список всех ID пользователей в системе. Пользователи читаются страницами,
+    поэтому соединение занимается только на время выборки одной страницы.
+    Для больших выборок лучше обходить страницы get_user_ids_page() самостоятельно.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    user_ids = []
+    page = get_user_ids_page(0, 1000)
+    while page:
+        user_ids.extend(page)
+        page = get_user_ids_page(page[-1], 1000)
     
-    cursor.execute('SELECT user_id FROM users')
-    results = cursor.fetchall()
-    
-    conn.close()
-    
-    return [row[0] for row in results]
+    return user_ids
 
 
 def add_temp_title(user_id: int, chat_id: int, title: str, expires_at: datetime):
     """
     Сохраняет информацию о временном титуле.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    _writer.execute(_execute_op, '''
         INSERT OR REPLACE INTO temp_titles (user_id, chat_id, title, expires_at)
         VALUES (?, ?, ?, ?)
     ''', (user_id, chat_id, title, expires_at))
-    
-    conn.commit()
-    conn.close()
 
 
 def get_expired_titles() -> list[tuple[int, int]]:
     """
     Возвращает список (user_id, chat_id) для всех истёкших титулов.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT user_id, chat_id FROM temp_titles
-        WHERE expires_at < ?
-    ''', (datetime.now(),))
-    results = cursor.fetchall()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT user_id, chat_id FROM temp_titles
+            WHERE expires_at < ?
+        ''', (datetime.now(),))
+        results = cursor.fetchall()
     
     return [(row[0], row[1]) for row in results]
 
@@ -676,71 +1683,142 @@ def remove_temp_title(user_id: int, chat_id: int):
     """
     Удаляет запись о временном титуле.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    _writer.execute(_execute_op, '''
         DELETE FROM temp_titles
         WHERE user_id = ? AND chat_id = ?
     ''', (user_id, chat_id))
-    
-    conn.commit()
-    conn.close()
 
 
 def add_interaction(user_id: int):
     """
     Добавляет или обновляет запись о взаимодействии пользователя с ботом.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Вставляем или обновляем время последнего сообщения пользователя
-    cursor.execute('''
+    _writer.execute(_execute_op, '''
         INSERT OR REPLACE INTO interactions (user_id, last_message)
         VALUES (?, ?)
     ''', (user_id, datetime.now()))
-    
-    conn.commit()
-    conn.close()
 
 
-def get_inactive_users(days: int = 30) -> list[int]:
+def queue_interaction(user_id: int):
     """
-    Возвращает список ID пользователей, которые не были активны в течение указанного количества дней.
+    Запоминает время последнего сообщения пользователя в буфере активности.
+    В базу данных запись попадет при следующем вызове flush_interactions().
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    with _interactions_lock:
+        _pending_interactions[user_id] = datetime.now()
+
+
+def flush_interactions() -> int:
+    """
+    Записывает накопленные в буфере времена сообщений одной транзакцией.
+    Возвращает количество записанных пользователей.
+    """
+    global _pending_interactions
     
-    # Вычисляем дату, которая была 'days' дней назад
-    cutoff_date = datetime.now()
-    cutoff_date = cutoff_date.replace(day=cutoff_date.day - days)
+    with _interactions_lock:
+        pending = _pending_interactions
+        _pending_interactions = {}
     
-    # Получаем пользователей, которые не взаимодействовали с ботом в течение указанного периода
-    cursor.execute('''
-        SELECT u.user_id
-        FROM users u
-        LEFT JOIN interactions i ON u.user_id = i.user_id
-        WHERE i.last_message < ? OR i.last_message IS NULL
-    ''', (cutoff_date,))
-    results = cursor.fetchall()
+    if not pending:
+        return 0
     
-    conn.close()
+    try:
+        _writer.execute(_executemany_op, '''
+            INSERT OR REPLACE INTO interactions (user_id, last_message)
+            VALUES (?, ?)
+        ''', list(pending.items()))
+    except Exception:
+        # Возвращаем записи в буфер, не затирая более свежие значения
+        with _interactions_lock:
+            for user_id, last_message in pending.items():
+                _pending_interactions.setdefault(user_id, last_message)
+        raise
+    
+    return len(pending)
+
+
+def get_users_to_remind_page(cutoff: datetime, after_user_id: int = 0, limit: int = 500) -> list[int]:
+    """
+    Возвращает следующую страницу ID пользователей после after_user_id, которые не были
+    активны с момента cutoff и которым еще не напоминали после их последнего сообщения.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT u.user_id
+            FROM users u
+            LEFT JOIN interactions i ON u.user_id = i.user_id
+            LEFT JOIN reminders r ON u.user_id = r.user_id
+            WHERE u.user_id > ?
+              AND (i.last_message < ? OR i.last_message IS NULL)
+              AND (r.reminded_at IS NULL OR r.reminded_at < i.last_message)
+            ORDER BY u.user_id
+            LIMIT ?
+        ''', (after_user_id, cutoff, limit))
+        results = cursor.fetchall()
     
     return [row[0] for row in results]
 
 
-def get_user_by_id(user_id: int) -> dict | None:
+def mark_users_reminded(user_ids: list[int]):
     """
-    Возвращает информацию о пользователе по его ID.
+    Запоминает, что пользователям отправлялось напоминание (в том числе недоставленное).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    now = datetime.now()
+    _writer.execute(_executemany_op, 'INSERT OR REPLACE INTO reminders (user_id, reminded_at) VALUES (?, ?)',
+                    [(user_id, now) for user_id in user_ids])
+
+
+def get_inactive_users_page(cutoff: datetime, after_user_id: int = 0, limit: int = 1000) -> list[int]:
+    """
+    Возвращает следующую страницу ID пользователей после after_user_id,
+    которые не были активны с момента cutoff.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Получаем пользователей, которые не взаимодействовали с ботом с момента cutoff
+        cursor.execute('''
+            SELECT u.user_id
+            FROM users u
+            LEFT JOIN interactions i ON u.user_id = i.user_id
+            WHERE u.user_id > ? AND (i.last_message < ? OR i.last_message IS NULL)
+            ORDER BY u.user_id
+            LIMIT ?
+        ''', (after_user_id, cutoff, limit))
+        results = cursor.fetchall()
     
-    cursor.execute('SELECT user_id, balance, xp, level FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+    return [row[0] for row in results]
+
+
+def get_inactive_users(days: int = 30) -> list[int]:
+    """
+    Возвращает список ID пользователей, которые не были активны в течение указанного количества дней.
+    Для больших выборок лучше обходить страницы get_inactive_users_page() самостоятельно.
+    """
+    # Вычитаем timedelta, а не меняем день месяца: replace(day=...) падал в начале месяца
+    cutoff_date = datetime.now() - timedelta(days=days)
     
-    conn.close()
+    user_ids = []
+    page = get_inactive_users_page(cutoff_date)
+    while page:
+        user_ids.extend(page)
+        page = get_inactive_users_page(cutoff_date, page[-1])
+    
+    return user_ids
+
+
+def get_user_by_id(user_id: int) -> dict | None:
+    """
+    Возвращает информацию о пользователе по его ID.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id, balance, xp, level FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
     if result:
         user_id, balance, xp, level = result
@@ -753,18 +1831,45 @@ def get_user_by_id(user_id: int) -> dict | None:
     return None
 
 
-def can_open_case(user_id: int) -> bool:
+def save_display_names(names: list[tuple[int, str, datetime]]):
     """
-    Проверяет, может ли пользователь открыть кейс (не открывал ли он его в течение последних 24 часов).
+    Сохраняет отображаемые имена пользователей одной транзакцией.
+    Кортеж: (user_id, display_name, updated_at).
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
+    _writer.execute(_executemany_op, '''
+        INSERT OR REPLACE INTO users_meta (user_id, display_name, updated_at)
+        VALUES (?, ?, ?)
+    ''', names)
+
+
+def get_display_name_record(user_id: int) -> tuple[str, datetime] | None:
+    """
+    Возвращает сохраненное отображаемое имя пользователя и время его обновления
+    или None, если имя неизвестно.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT display_name, updated_at FROM users_meta WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
-    # Получаем время последнего открытия кейса
-    cursor.execute('SELECT last_open FROM event_cases WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+    if result is None:
+        return None
     
-    conn.close()
+    display_name, updated_at = result
+    return display_name, datetime.fromisoformat(updated_at)
+
+
+def can_open_case(user_id: int) -> bool:
+    """
+    Проверяет, может ли пользователь открыть кейс (не открывал ли он его в течение последних 24 часов).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Получаем время последнего открытия кейса
+        cursor.execute('SELECT last_open FROM event_cases WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
     
     if result and result[0]:
         last_open = datetime.fromisoformat(result[0])
@@ -779,29 +1884,21 @@ def update_last_open_case_time(user_id: int):
     """
     Обновляет время последнего открытия кейса для пользователя.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    _writer.execute(_execute_op, '''
         INSERT OR REPLACE INTO event_cases (user_id, last_open)
         VALUES (?, ?)
     ''', (user_id, datetime.now()))
-    
-    conn.commit()
-    conn.close()
 
 
 def get_active_vote() -> dict | None:
     """
     Возвращает активное голосование, если оно есть.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT id, question, option_a, option_b, votes_a, votes_b, active FROM votes WHERE active = 1 LIMIT 1')
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id, question, option_a, option_b, votes_a, votes_b, active FROM votes WHERE active = 1 LIMIT 1')
+        result = cursor.fetchone()
     
     if result:
         vote_id, question, option_a, option_b, votes_a, votes_b, active = result
@@ -819,29 +1916,22 @@ def add_vote_for_option(vote_id: int, option_index: int):
     """
     Добавляет голос за указанный вариант в голосовании.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     if option_index == 0:
-        cursor.execute('UPDATE votes SET votes_a = votes_a + 1 WHERE id = ?', (vote_id,))
+        _writer.execute(_execute_op, 'UPDATE votes SET votes_a = votes_a + 1 WHERE id = ?', (vote_id,))
     elif option_index == 1:
-        cursor.execute('UPDATE votes SET votes_b = votes_b + 1 WHERE id = ?', (vote_id,))
-    
-    conn.commit()
-    conn.close()
+        _writer.execute(_execute_op, 'UPDATE votes SET votes_b = votes_b + 1 WHERE id = ?', (vote_id,))
 
 
 def has_user_voted(vote_id: int, user_id: int) -> bool:
     """
     Проверяет, голосовал ли пользователь в указанном голосовании.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Проверяем, есть ли запись о голосовании пользователя в этом голосовании
-    # В реальной реализации потребуется дополнительная таблица для отслеживания голосов пользователей
-    # Здесь временно возвращаем False, чтобы избежать ошибки
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Проверяем, есть ли запись о голосовании пользователя в этом голосовании
+        # В реальной реализации потребуется дополнительная таблица для отслеживания голосов пользователей
+        # Здесь временно возвращаем False, чтобы избежать ошибки
     
     return False
 
@@ -850,14 +1940,12 @@ def get_faq_answer(question: str) -> str | None:
     """
     Возвращает ответ на вопрос из FAQ.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
-    # Ищем частичное совпадение вопроса в базе FAQ
-    cursor.execute('SELECT answer FROM faq WHERE question LIKE ?', (f'%{question}%',))
-    result = cursor.fetchone()
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Ищем частичное совпадение вопроса в базе FAQ
+        cursor.execute('SELECT answer FROM faq WHERE question LIKE ?', (f'%{question}%',))
+        result = cursor.fetchone()
     
     if result:
         return result[0]
@@ -868,14 +1956,8 @@ def add_faq_entry(question: str, answer: str):
     """
     Добавляет запись в FAQ.
     """
-    conn = sqlite3.connect('vapelume.db')
-    cursor = conn.cursor()
-    
     # Добавляем или заменяем запись в FAQ
-    cursor.execute('''
+    _writer.execute(_execute_op, '''
         INSERT OR REPLACE INTO faq (question, answer)
         VALUES (?, ?)
-    ''', (question, answer))
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    ''', (question, answer))
\ No newline at end of file
@@ -0,0 +1,60 @@
+import os
+from functools import wraps
+from database import get_bound_supergroup_id, get_admin_ids
+
+OWNER_ID = int(os.getenv('OWNER_ID', '8415112409'))
+
+
+def is_bound_supergroup(chat) -> bool:
+    """
+    Проверяет, что чат - это привязанная супергруппа.
+    ID супергруппы берется из кэша настроек, без обращения к базе.
+    """
+    return chat.type in ['group', 'supergroup'] and chat.id == get_bound_supergroup_id()
+
+
+def group_only(func):
+    """
+    Декоратор, который проверяет, что команда вызвана в привязанной супергруппе.
+    """
+    @wraps(func)
+    async def wrapper(update, context):
+        if not is_bound_supergroup(update.effective_chat):
+            return  # Игнорировать команду, если она вызвана не в привязанной супергруппе
+
+        return await func(update, context)
+    return wrapper
+
+
+def owner_only(func):
+    """
+    Декоратор, который проверяет, является ли автор сообщения владельцем.
+    """
+    @wraps(func)
+    async def wrapper(update, context):
+        user_id = update.effective_user.id
+        if user_id != OWNER_ID:
+            return # Игнорировать команду, если пользователь не является владельцем
+        return await func(update, context)
+    return wrapper
+
+
+def is_admin(user_id: int) -> bool:
+    """
+    Проверяет, является ли пользователь владельцем или есть в списке администраторов.
+    Список администраторов берется из кэша, без обращения к базе.
+    """
+    return user_id == OWNER_ID or user_id in get_admin_ids()
+
+
+def admin_only(func):
+    """
+    Декоратор, использующий is_admin() для проверки прав.
+    """
+    @wraps(func)
+    async def wrapper(update, context):
+        user_id = update.effective_user.id
+        if not is_admin(user_id):
+            return  # Игнорировать команду, если пользователь не является администратором
+        return await func(update, context)
+    return wrapper
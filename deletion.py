@@ -0,0 +1,127 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from telegram.ext import ContextTypes
+from database import save_pending_deletions, get_pending_deletions
+from async_db import run_in_db, remove_pending_deletions
+
+DELETE_DELAY = int(os.getenv('DELETE_DELAY', '300'))  # Через сколько секунд удалять игровые сообщения
+DELETION_TICK = int(os.getenv('DELETION_TICK', '5'))  # Как часто проверять очередь удаления, сек
+DELETE_BATCH_SIZE = 100  # Максимум сообщений в одном вызове delete_messages
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionScheduler:
+    """
+    Очередь отложенного удаления сообщений: куча (due_at, chat_id, message_id)
+    в памяти плюс копия в таблице pending_deletions. Новые записи сохраняются
+    в базу пакетом на каждом такте таймера.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._unsaved = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Загружает из базы сообщения, не удаленные до перезапуска бота.
+        """
+        pending = get_pending_deletions()
+        with self._lock:
+            self._heap = [(due_at, chat_id, message_id) for chat_id, message_id, due_at in pending]
+            heapq.heapify(self._heap)
+
+    def schedule(self, chat_id: int, *message_ids: int, delay: int = DELETE_DELAY):
+        """
+        Ставит сообщения чата в очередь на удаление через delay секунд.
+        """
+        due_at = time.time() + delay
+        with self._lock:
+            for message_id in message_ids:
+                heapq.heappush(self._heap, (due_at, chat_id, message_id))
+                self._unsaved.append((chat_id, message_id, due_at))
+
+    def persist(self):
+        """
+        Сохраняет в базу записи, добавленные с прошлого такта.
+        """
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, []
+
+        if unsaved:
+            try:
+                save_pending_deletions(unsaved)
+            except Exception:
+                with self._lock:
+                    self._unsaved = unsaved + self._unsaved
+                raise
+
+    def pop_due(self) -> dict[int, list[int]]:
+        """
+        Извлекает из очереди сообщения, время удаления которых наступило.
+        Возвращает {chat_id: [message_id, ...]}.
+        """
+        now = time.time()
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, chat_id, message_id = heapq.heappop(self._heap)
+                due.setdefault(chat_id, []).append(message_id)
+        return due
+
+
+deletion_scheduler = DeletionScheduler()
+
+
+def schedule_deletion(chat_id: int, *message_ids: int, delay: int = DELETE_DELAY):
+    """
+    Ставит сообщения в очередь на удаление через delay секунд (по умолчанию DELETE_DELAY).
+    """
+    deletion_scheduler.schedule(chat_id, *message_ids, delay=delay)
+
+
+async def _delete_batch(bot, chat_id: int, message_ids: list[int]):
+    """
+    Удаляет сообщения одного чата: одним запросом delete_messages, если он доступен
+    в используемой версии библиотеки, иначе по одному.
+    """
+    if hasattr(bot, 'delete_messages'):
+        for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[i:i + DELETE_BATCH_SIZE])
+            except Exception:
+                pass  # Сообщения могли быть уже удалены
+        return
+
+    for message_id in message_ids:
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except Exception:
+            pass  # Сообщение могло быть уже удалено
+
+
+async def process_deletions(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Такт таймера удаления: сохраняет новые записи в базу и удаляет сообщения,
+    время которых наступило.
+    """
+    try:
+        await run_in_db(deletion_scheduler.persist)
+    except Exception as e:
+        logger.error(f'Ошибка при сохранении очереди удаления: {e}')
+
+    due = deletion_scheduler.pop_due()
+    if not due:
+        return
+
+    for chat_id, message_ids in due.items():
+        await _delete_batch(context.bot, chat_id, message_ids)
+
+    try:
+        await remove_pending_deletions([(chat_id, message_id) for chat_id, message_ids in due.items() for message_id in message_ids])
+    except Exception as e:
+        logger.error(f'Ошибка при очистке очереди удаления: {e}')
@@ -2,16 +2,20 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 import random
 from datetime import datetime, timedelta
-from database import (
-    get_user_by_id, update_user_balance, add_xp,
+from async_db import (
+    get_user_by_id, update_user_balance, debit_if_sufficient, add_xp,
     can_open_case, update_last_open_case_time,
     get_active_vote, add_vote_for_option, has_user_voted,
     get_faq_answer, add_faq_entry, get_user_balance
 )
 import logging
+from decorators import is_admin
+from locks import serialized_per_user
+from money import CENTS_PER_COIN, to_cents, parse_coins, format_coins
 
 logger = logging.getLogger(__name__)
 
+@serialized_per_user
 async def burn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для сжигания LumeCoin в обмен на XP"""
     user_id = update.effective_user.id
@@ -21,64 +25,64 @@ async def burn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('Используйте: /burn [сумма]')
         return
     
-    try:
-        amount = int(context.args[0])
-        if amount <= 0:
-            await update.message.reply_text('Сумма должна быть положительной!')
-            return
-    except ValueError:
+    amount = parse_coins(context.args[0])
+    if amount is None:
         await update.message.reply_text('Некорректная сумма!')
         return
+    if amount <= 0:
+        await update.message.reply_text('Сумма должна быть положительной!')
+        return
     
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     if not user:
         await update.message.reply_text('Вы не зарегистрированы в системе!')
         return
     
-    if user['balance'] < amount:
-        await update.message.reply_text(f'Недостаточно средств! Ваш баланс: {user["balance"]} LumeCoin')
+    # Списываем монеты, только если их хватает: проверка и списание - одна операция
+    new_balance = await debit_if_sufficient(user_id, amount, reason='burn')
+    if new_balance is None:
+        user = await get_user_by_id(user_id)
+        await update.message.reply_text(f'Недостаточно средств! Ваш баланс: {format_coins(user["balance"])} LumeCoin')
         return
     
-    # Рассчитываем XP (1 LumeCoin = 2 XP)
-    xp_gain = amount * 2
-    
-    # Обновляем баланс и XP
-    update_user_balance(user_id, -amount)
-    add_xp(user_id, xp_gain)
+    # Рассчитываем XP (1 LumeCoin = 2 XP, неполная монета XP не дает)
+    xp_gain = amount * 2 // CENTS_PER_COIN
+    await add_xp(user_id, xp_gain)
     
+    user = await get_user_by_id(user_id)
     await update.message.reply_text(
-        f'🔥 Вы сожгли {amount} LumeCoin и получили {xp_gain} XP!\n'
-        f'Ваш новый баланс: {get_user_by_id(user_id)["balance"]} LumeCoin\n'
-        f'Ваш XP: {get_user_by_id(user_id)["xp"]}'
+        f'🔥 Вы сожгли {format_coins(amount)} LumeCoin и получили {xp_gain} XP!\n'
+        f'Ваш новый баланс: {format_coins(user["balance"])} LumeCoin\n'
+        f'Ваш XP: {user["xp"]}'
     )
 
+@serialized_per_user
 async def case_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для открытия кейса"""
     user_id = update.effective_user.id
     username = update.effective_user.username or str(user_id)
     
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     if not user:
         await update.message.reply_text('Вы не зарегистрированы в системе!')
         return
     
     # Проверяем, можно ли открыть кейс
-    if not can_open_case(user_id):
+    if not await can_open_case(user_id):
         await update.message.reply_text('Вы уже открывали кейс в течение последних 24 часов!')
         return
     
     # Стоимость кейса
-    case_cost = 100
-    if user['balance'] < case_cost:
-        await update.message.reply_text(f'Недостаточно средств для открытия кейса! Стоимость: {case_cost} LumeCoin')
-        return
+    case_cost = to_cents(100)
     
-    # Списываем стоимость кейса
-    update_user_balance(user_id, -case_cost)
+    # Списываем стоимость кейса до выдачи приза, только если хватает средств
+    if await debit_if_sufficient(user_id, case_cost, reason='case') is None:
+        await update.message.reply_text(f'Недостаточно средств для открытия кейса! Стоимость: {format_coins(case_cost)} LumeCoin')
+        return
     
     # Определяем приз
     prizes = [
-        {'type': 'coin', 'value': random.randint(50, 200), 'description': 'LumeCoin'},
+        {'type': 'coin', 'value': to_cents(random.randint(50, 200)), 'description': 'LumeCoin'},
         {'type': 'xp', 'value': random.randint(50, 300), 'description': 'XP'},
         {'type': 'rare', 'value': 'Редкое достижение', 'description': 'редкое достижение'}
     ]
@@ -89,21 +93,21 @@ async def case_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Выдаем приз
     if prize['type'] == 'coin':
-        update_user_balance(user_id, prize['value'])
-        prize_text = f'{prize["value"]} {prize["description"]}'
+        await update_user_balance(user_id, prize['value'], reason='case')
+        prize_text = f'{format_coins(prize["value"])} {prize["description"]}'
     elif prize['type'] == 'xp':
-        add_xp(user_id, prize['value'])
+        await add_xp(user_id, prize['value'])
         prize_text = f'{prize["value"]} {prize["description"]}'
     else:  # rare achievement
         # В реальной реализации можно добавить запись о достижении в БД
         prize_text = f'{prize["value"]}'
     
     # Обновляем время последнего открытия кейса
-    update_last_open_case_time(user_id)
+    await update_last_open_case_time(user_id)
     
     await update.message.reply_text(
         f'🎁 Вы открыли кейс и получили: {prize_text}!\n'
-        f'Стоимость кейса ({case_cost} LumeCoin) была списана с вашего баланса.'
+        f'Стоимость кейса ({format_coins(case_cost)} LumeCoin) была списана с вашего баланса.'
     )
 
 async def vote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -112,7 +116,7 @@ async def vote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or str(user_id)
     
     # Получаем активное голосование
-    active_vote = get_active_vote()
+    active_vote = await get_active_vote()
     if not active_vote:
         await update.message.reply_text('На данный момент нет активных голосований.')
         return
@@ -122,7 +126,7 @@ async def vote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     options = active_vote['options']
     
     # Проверяем, голосовал ли пользователь уже
-    if has_user_voted(vote_id, user_id):
+    if await has_user_voted(vote_id, user_id):
         await update.message.reply_text('Вы уже проголосовали в этом голосовании!')
         return
     
@@ -152,18 +156,18 @@ async def button_vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     option_index = int(data_parts[2])
     
     # Проверяем, есть ли активное голосование
-    active_vote = get_active_vote()
+    active_vote = await get_active_vote()
     if not active_vote or active_vote['id'] != vote_id:
         await query.edit_message_text('Голосование уже завершено.')
         return
     
     # Проверяем, голосовал ли пользователь уже
-    if has_user_voted(vote_id, user_id):
+    if await has_user_voted(vote_id, user_id):
         await query.edit_message_text('Вы уже проголосовали в этом голосовании!')
         return
     
     # Добавляем голос
-    add_vote_for_option(vote_id, option_index)
+    await add_vote_for_option(vote_id, option_index)
     
     await query.edit_message_text(f'✅ Вы проголосовали за: {active_vote["options"][option_index]}')
 
@@ -176,7 +180,7 @@ async def helpme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     question = ' '.join(context.args)
     
     # Ищем ответ в FAQ
-    answer = get_faq_answer(question)
+    answer = await get_faq_answer(question)
     
     if answer:
         await update.message.reply_text(f'🔍 Найден ответ на ваш вопрос:\n\n{answer}')
@@ -191,11 +195,7 @@ async def addfaq_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Проверяем, является ли пользователь админом
-    # Здесь можно использовать функцию из admin_panel.py или свою проверку
-    # Для упрощения временно используем список админов
-    ADMIN_IDS = [370213481]  # Замените на реальные ID админов
-    
-    if user_id not in ADMIN_IDS:
+    if not is_admin(user_id):
         await update.message.reply_text('У вас нет прав для выполнения этой команды.')
         return
     
@@ -218,7 +218,7 @@ async def addfaq_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Добавляем запись в FAQ
-    add_faq_entry(question, answer)
+    await add_faq_entry(question, answer)
     
     await update.message.reply_text('✅ Вопрос-ответ успешно добавлены в FAQ.')
 
@@ -1,42 +1,34 @@
 import random
-import asyncio
 from telegram import Update
 from telegram.ext import ContextTypes, Application
-from database import get_user_balance, update_user_balance, get_game_setting
+from database import get_game_setting
+from async_db import get_user_balance, settle_round, settle_penalty
+from decorators import group_only
+from deletion import schedule_deletion
+from animation import play_sequence, one_round_at_a_time
+from locks import serialized_per_user
+from money import to_cents, parse_coins, scale, format_coins
 
-def group_only(func):
-    """
-    Декоратор, который проверяет, что команда вызвана в привязанной супергруппе.
-    """
-    from functools import wraps
-    @wraps(func)
-    async def wrapper(update, context):
-        # Импортируем здесь, чтобы избежать циклической зависимости
-        from database import get_bound_supergroup_id
-        
-        chat_id = update.effective_chat.id
-        bound_supergroup_id = get_bound_supergroup_id()
-        
-        # Проверяем, что чат - это привязанная супергруппа
-        if update.effective_chat.type not in ['group', 'supergroup'] or chat_id != bound_supergroup_id:
-            return  # Игнорировать команду, если она вызвана не в привязанной супергруппе
-        
-        return await func(update, context)
-    return wrapper
 
-
-async def delete_message_after_delay(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, delay: int):
+async def send_round_result(update: Update, new_balance: int, result_text: str | None = None):
     """
-    Удаляет сообщение через заданное количество секунд
+    Отправляет итог раунда (если есть) и сообщение с балансом, ставит их в очередь на удаление.
     """
-    await asyncio.sleep(delay)
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception:
-        pass  # Сообщение могло быть уже удалено
+    message_ids = []
+    if result_text:
+        result_msg = await update.message.reply_text(result_text)
+        message_ids.append(result_msg.id)
+    
+    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {format_coins(new_balance)} LumeCoin')
+    message_ids.append(final_msg.id)
+    
+    # Удаляем сообщения через 5 минут
+    schedule_deletion(update.effective_chat.id, *message_ids)
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def roulette(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Игра в рулетку
@@ -50,86 +42,53 @@ async def roulette(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем аргументы
     if not context.args or len(context.args) != 1:
         message = await update.message.reply_text('❌ Укажите ставку: /roulette <ставка>')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    try:
-        bet = float(context.args[0])
-        if bet < 25:
-            message = await update.message.reply_text('❌ Минимальная ставка 25 LumeCoin')
-            context.application.job_queue.run_once(
-                lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-                when=300
-            )
-            return
-    except ValueError:
+    bet = parse_coins(context.args[0])
+    if bet is None:
         message = await update.message.reply_text('❌ Некорректная ставка. Укажите число: /roulette <ставка>')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        schedule_deletion(update.effective_chat.id, message.id)
         return
-    
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
-    if balance < bet:
-        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {balance:.1f} LumeCoin')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+    if bet < to_cents(25):
+        message = await update.message.reply_text('❌ Минимальная ставка 25 LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
+    # Определяем результат и проводим раунд одной транзакцией
+    result = random.choices(['win', 'lose'], weights=[30, 70])[0]
+    win_amount = scale(bet, 2) if result == 'win' else 0
+    new_balance = await settle_round(user_id, bet, win_amount)
+    if new_balance is None:
+        balance = await get_user_balance(user_id)
+        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(balance)} LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
+        return
     
     # Анимация: 🎰
     msg = await update.message.reply_text('🎰')
-    await asyncio.sleep(1)
-    
-    # Определяем результат
-    result = random.choices(['win', 'lose'], weights=[30, 70])[0]
+    schedule_deletion(update.effective_chat.id, update.message.id, msg.id)
     
+    # Анимация: 🔴/⚫️/🟢 (в зависимости от числа)
+    color = random.choice(['🔴', '⚫️', '🟢'])
     if result == 'win':
         # Выигрыш (x2)
-        win_amount = bet * 2
-        update_user_balance(user_id, win_amount)
-        # Анимация: 🔴/⚫️/🟢 (в зависимости от числа)
-        color = random.choice(['🔴', '⚫️', '🟢'])
-        await msg.edit_text(f'{color}')
-        await asyncio.sleep(1)
-        await msg.edit_text(f'🎉 Поздравляем! Вы выиграли {win_amount:.1f} LumeCoin!')
+        result_text = f'🎉 Поздравляем! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     else:
         # Проигрыш
-        # Анимация: 🔴/⚫️/🟢 (в зависимости от числа)
-        color = random.choice(['🔴', '⚫️', '🟢'])
-        await msg.edit_text(f'{color}')
-        await asyncio.sleep(1)
-        await msg.edit_text(f'😔 Вы проиграли {bet:.1f} LumeCoin.')
-    
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
-    
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
+        result_text = f'😔 Вы проиграли {format_coins(bet)} LumeCoin.'
+    
+    # Остальные кадры проигрываются в фоне, обработчик завершается сразу
+    play_sequence(context.application, [
+        (1, lambda: msg.edit_text(color)),
+        (1, lambda: msg.edit_text(result_text)),
+        (0, lambda: send_round_result(update, new_balance)),
+    ], user_id)
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Игра в кости
@@ -139,57 +98,38 @@ async def play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Анимация: 🎲 → ... → результат.
     """
     user_id = update.effective_user.id
-    bet = 25
+    bet = to_cents(25)
     
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
-    if balance < bet:
-        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {balance:.1f} LumeCoin')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+    # Определяем результат и проводим раунд одной транзакцией (выигрыш 40 LumeCoin)
+    result = random.choices(['win', 'lose'], weights=[40, 60])[0]
+    win_amount = to_cents(40) if result == 'win' else 0
+    new_balance = await settle_round(user_id, bet, win_amount)
+    if new_balance is None:
+        balance = await get_user_balance(user_id)
+        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(balance)} LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
     # Анимация: 🎲
     msg = await update.message.reply_text('🎲')
-    await asyncio.sleep(2)
-    
-    # Определяем результат
-    result = random.choices(['win', 'lose'], weights=[40, 60])[0]
+    schedule_deletion(update.effective_chat.id, update.message.id, msg.id)
     
     if result == 'win':
-        # Выигрыш 40 LumeCoin
-        win_amount = 40
-        update_user_balance(user_id, win_amount)
-        await msg.edit_text(f'🎉 Поздравляем! Вы выиграли {win_amount:.1f} LumeCoin!')
+        result_text = f'🎉 Поздравляем! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     else:
         # Проигрыш
-        await msg.edit_text(f'😔 Вы проиграли {bet:.1f} LumeCoin.')
+        result_text = f'😔 Вы проиграли {format_coins(bet)} LumeCoin.'
     
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
-    
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
+    # Остальные кадры проигрываются в фоне, обработчик завершается сразу
+    play_sequence(context.application, [
+        (2, lambda: msg.edit_text(result_text)),
+        (0, lambda: send_round_result(update, new_balance)),
+    ], user_id)
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def russian(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Русская рулетка
@@ -201,53 +141,44 @@ async def russian(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_id = update.effective_user.id
     
-    # Анимация: 🔫
-    msg = await update.message.reply_text('🔫')
-    await asyncio.sleep(2)
-    
-    # Определяем результат
+    # Определяем результат и проводим раунд (игра бесплатная, выигрыш 35 LumeCoin)
     result = random.choices(['lose', 'win'], weights=[65, 35])[0]
+    win_amount = to_cents(35) if result == 'win' else 0
+    new_balance = await settle_round(user_id, 0, win_amount)
     
-    if result == 'lose':
-        # Мут на 5 минут
-        from datetime import datetime, timedelta
-        mute_until = datetime.now() + timedelta(minutes=5)
-        try:
-            await context.bot.restrict_chat_member(
-                chat_id=update.effective_chat.id,
-                user_id=user_id,
-                permissions=context.bot.get_chat(update.effective_chat.id).permissions,
-                until_date=mute_until
-            )
-            await msg.edit_text(f'💥 Вы проиграли! Мут на 5 минут.')
-        except Exception:
-            await msg.edit_text(f'💥 Вы проиграли! (Не удалось выдать мут)')
-    else:
-        # Выигрыш 35 LumeCoin
-        win_amount = 35
-        update_user_balance(user_id, win_amount)
-        await msg.edit_text(f'💰 Поздравляем! Вы выиграли {win_amount:.1f} LumeCoin!')
-    
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
-    
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
+    # Анимация: 🔫
+    msg = await update.message.reply_text('🔫')
+    schedule_deletion(update.effective_chat.id, update.message.id, msg.id)
+    
+    async def reveal():
+        if result == 'lose':
+            # Мут на 5 минут
+            from datetime import datetime, timedelta
+            mute_until = datetime.now() + timedelta(minutes=5)
+            try:
+                await context.bot.restrict_chat_member(
+                    chat_id=update.effective_chat.id,
+                    user_id=user_id,
+                    permissions=context.bot.get_chat(update.effective_chat.id).permissions,
+                    until_date=mute_until
+                )
+                await msg.edit_text(f'💥 Вы проиграли! Мут на 5 минут.')
+            except Exception:
+                await msg.edit_text(f'💥 Вы проиграли! (Не удалось выдать мут)')
+        else:
+            # Выигрыш 35 LumeCoin
+            await msg.edit_text(f'💰 Поздравляем! Вы выиграли {format_coins(win_amount)} LumeCoin!')
+    
+    # Остальные кадры проигрываются в фоне, обработчик завершается сразу
+    play_sequence(context.application, [
+        (2, reveal),
+        (0, lambda: send_round_result(update, new_balance)),
+    ], user_id)
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def jewish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Еврейская рулетка
@@ -259,50 +190,34 @@ async def jewish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_id = update.effective_user.id
     
-    # Анимация: ✡️
-    msg = await update.message.reply_text('✡️')
-    await asyncio.sleep(2)
-    
     # Определяем результат
     result = random.choices(['lose', 'win'], weights=[50, 50])[0]
     
     if result == 'lose':
-        # Проигрыш 35 LumeCoin
-        loss_amount = 35
-        balance = get_user_balance(user_id)
-        if balance >= loss_amount:
-            update_user_balance(user_id, -loss_amount)
-            await msg.edit_text(f'💸 Вы проиграли {loss_amount:.1f} LumeCoin.')
-        else:
-            # Если баланс меньше, проигрываем всю сумму
-            update_user_balance(user_id, -balance)
-            await msg.edit_text(f'💸 Вы проиграли {balance:.1f} LumeCoin.')
+        # Проигрыш 35 LumeCoin; если баланс меньше, проигрываем всю сумму
+        # Списанная сумма считается в той же операции, что и списание
+        loss_amount, new_balance = await settle_penalty(user_id, to_cents(35))
+        result_text = f'💸 Вы проиграли {format_coins(loss_amount)} LumeCoin.'
     else:
         # Выигрыш 25 LumeCoin
-        win_amount = 25
-        update_user_balance(user_id, win_amount)
-        await msg.edit_text(f'🤑 Поздравляем! Вы выиграли {win_amount:.1f} LumeCoin!')
+        win_amount = to_cents(25)
+        new_balance = await settle_round(user_id, 0, win_amount)
+        result_text = f'🤑 Поздравляем! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
+    # Анимация: ✡️
+    msg = await update.message.reply_text('✡️')
+    schedule_deletion(update.effective_chat.id, update.message.id, msg.id)
     
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
+    # Остальные кадры проигрываются в фоне, обработчик завершается сразу
+    play_sequence(context.application, [
+        (2, lambda: msg.edit_text(result_text)),
+        (0, lambda: send_round_result(update, new_balance)),
+    ], user_id)
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Игра в кости с Telegram-анимацией
@@ -316,82 +231,69 @@ async def dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем аргументы
     if not context.args or len(context.args) != 1:
         message = await update.message.reply_text('❌ Укажите ставку: /dice <ставка>')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    try:
-        bet = float(context.args[0])
-        if bet < 10 or bet > 100:
-            message = await update.message.reply_text('❌ Ставка должна быть от 10 до 100 LumeCoin')
-            context.application.job_queue.run_once(
-                lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-                when=300
-            )
-            return
-    except ValueError:
+    bet = parse_coins(context.args[0])
+    if bet is None:
         message = await update.message.reply_text('❌ Некорректная ставка. Укажите число: /dice <ставка>')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        schedule_deletion(update.effective_chat.id, message.id)
+        return
+    if bet < to_cents(10) or bet > to_cents(100):
+        message = await update.message.reply_text('❌ Ставка должна быть от 10 до 100 LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
+    # Проверяем баланс до броска (окончательная проверка - при проведении раунда)
+    balance = await get_user_balance(user_id)
     if balance < bet:
-        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {balance:.1f} LumeCoin')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(balance)} LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
     # Бросаем кубик
     dice_msg = await context.bot.send_dice(chat_id=update.effective_chat.id, message_thread_id=update.message.message_thread_id if update.message.is_topic_message else None)
+    # Команда и кубик удаляются при любом исходе раунда
+    schedule_deletion(update.effective_chat.id, update.message.id, dice_msg.id)
     dice_value = dice_msg.dice.value
     
-    await asyncio.sleep(3)  # Ждем завершения анимации кубика
+    # Проводим раунд одной транзакцией: при значении ≥ 4 выигрыш x1.5
+    win_amount = scale(bet, '1.5') if dice_value >= 4 else 0
+    new_balance = await settle_round(user_id, bet, win_amount)
+    if new_balance is None:
+        message = await update.message.reply_text('❌ Недостаточно средств для ставки.')
+        schedule_deletion(update.effective_chat.id, message.id)
+        return
     
     # Определяем результат
     if dice_value >= 4:
         # Выигрыш x1.5
-        win_amount = bet * 1.5
-        update_user_balance(user_id, win_amount)
-        result_msg = await update.message.reply_text(f'🎉 Поздравляем! Вы выиграли {win_amount:.1f} LumeCoin!')
+        result_text = f'🎉 Поздравляем! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     else:
         # Проигрыш
-        result_msg = await update.message.reply_text(f'😔 Вы проиграли {bet:.1f} LumeCoin.')
+        result_text = f'😔 Вы проиграли {format_coins(bet)} LumeCoin.'
     
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
-    
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, dice_msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, result_msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
+    # Результат отправляется в фоне после завершения анимации кубика
+    play_sequence(context.application, [
+        (3, lambda: send_round_result(update, new_balance, result_text)),
+    ], user_id)
+
+
+def slots_payout(bet: int, dice_value: int) -> int:
+    """
+    Возвращает выигрыш в слотах (в сотых долях монеты) по значению dice.value (от 1 до 64):
+    1 - 3 совпадения (x5), 2-7 - 2 совпадения (x2), остальное - проигрыш.
+    """
+    if dice_value == 1:
+        return scale(bet, 5)
+    elif 2 <= dice_value <= 7:
+        return scale(bet, 2)
+    return 0
 
 
 @group_only
+@one_round_at_a_time
+@serialized_per_user
 async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Игра в слоты
@@ -404,26 +306,28 @@ async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     2 совпадения: выигрыш x2.
     """
     user_id = update.effective_user.id
-    bet = 50
+    bet = to_cents(50)
     
-    # Проверяем баланс
-    balance = get_user_balance(user_id)
+    # Проверяем баланс до броска (окончательная проверка - при проведении раунда)
+    balance = await get_user_balance(user_id)
     if balance < bet:
-        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {balance:.1f} LumeCoin')
-        context.application.job_queue.run_once(
-            lambda _: delete_message_after_delay(context, update.effective_chat.id, message.id, 300),
-            when=300
-        )
+        message = await update.message.reply_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(balance)} LumeCoin')
+        schedule_deletion(update.effective_chat.id, message.id)
         return
     
-    # Снимаем ставку
-    update_user_balance(user_id, -bet)
-    
     # Бросаем слоты
     dice_msg = await context.bot.send_dice(chat_id=update.effective_chat.id, emoji="🎰", message_thread_id=update.message.message_thread_id if update.message.is_topic_message else None)
+    # Команда и кубик удаляются при любом исходе раунда
+    schedule_deletion(update.effective_chat.id, update.message.id, dice_msg.id)
     dice_value = dice_msg.dice.value
     
-    await asyncio.sleep(3)  # Ждем завершения анимации
+    # Проводим раунд одной транзакцией
+    win_amount = slots_payout(bet, dice_value)
+    new_balance = await settle_round(user_id, bet, win_amount)
+    if new_balance is None:
+        message = await update.message.reply_text('❌ Недостаточно средств для ставки.')
+        schedule_deletion(update.effective_chat.id, message.id)
+        return
     
     # Определяем выигрыш на основе значения кубика
     # В Telegram слотах значения от 1 до 64:
@@ -433,36 +337,15 @@ async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if dice_value == 1:
         # Джекпот - 3 совпадения
-        win_amount = bet * 5
-        update_user_balance(user_id, win_amount)
-        result_msg = await update.message.reply_text(f'🎰🎉 Джекпот! Вы выиграли {win_amount:.1f} LumeCoin!')
+        result_text = f'🎰🎉 Джекпот! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     elif 2 <= dice_value <= 7:
         # 2 совпадения
-        win_amount = bet * 2
-        update_user_balance(user_id, win_amount)
-        result_msg = await update.message.reply_text(f'🎰💰 2 совпадения! Вы выиграли {win_amount:.1f} LumeCoin!')
+        result_text = f'🎰💰 2 совпадения! Вы выиграли {format_coins(win_amount)} LumeCoin!'
     else:
         # Проигрыш
-        result_msg = await update.message.reply_text(f'🎰😔 Вы проиграли {bet:.1f} LumeCoin.')
-    
-    # Обновляем баланс и отправляем финальное сообщение
-    new_balance = get_user_balance(user_id)
-    final_msg = await update.message.reply_text(f'💰 Ваш баланс: {new_balance:.1f} LumeCoin')
+        result_text = f'🎰😔 Вы проиграли {format_coins(bet)} LumeCoin.'
     
-    # Удаляем сообщения через 5 минут
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, update.message.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, dice_msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, result_msg.id, 300),
-        when=300
-    )
-    context.application.job_queue.run_once(
-        lambda _: delete_message_after_delay(context, update.effective_chat.id, final_msg.id, 300),
-        when=300
-    )
\ No newline at end of file
+    # Результат отправляется в фоне после завершения анимации слотов
+    play_sequence(context.application, [
+        (3, lambda: send_round_result(update, new_balance, result_text)),
+    ], user_id)
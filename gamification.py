@@ -1,32 +1,21 @@
 import asyncio
+import logging
+import os
+import threading
 from telegram import Update
 from telegram.ext import ContextTypes, MessageHandler, filters, CommandHandler
-from database import add_xp, get_user_profile, get_user_achievements, grant_achievement
-
-def group_only(func):
-    """
-    Декоратор, который проверяет, что команда вызвана в привязанной супергруппе.
-    """
-    from functools import wraps
-    @wraps(func)
-    async def wrapper(update, context):
-        # Импортируем здесь, чтобы избежать циклической зависимости
-        from database import get_bound_supergroup_id
-        
-        chat_id = update.effective_chat.id
-        bound_supergroup_id = get_bound_supergroup_id()
-        
-        # Проверяем, что чат - это привязанная супергруппа
-        if update.effective_chat.type not in ['group', 'supergroup'] or chat_id != bound_supergroup_id:
-            return  # Игнорировать команду, если она вызвана не в привязанной супергруппе
-        
-        return await func(update, context)
-    return wrapper
+from database import add_xp_batch
+from money import format_coins
+from async_db import run_in_db, get_user_profile, get_user_achievements, grant_achievement
+from decorators import is_bound_supergroup
+from leveling import level_curve
 
 # Константы для геймификации
 XP_PER_MESSAGE = 10
-XP_LEVEL_THRESHOLD = 500  # Опыт, необходимый для повышения уровня (базовый)
 COOLDOWN_SECONDS = 60 # Кулдаун в секундах между начислениями XP за сообщения
+XP_FLUSH_INTERVAL = int(os.getenv('XP_FLUSH_INTERVAL', '10'))  # Интервал пакетной записи XP в секундах
+
+logger = logging.getLogger(__name__)
 
 # Словарь для отслеживания времени последнего получения XP пользователем
 last_xp_time = {}
@@ -54,6 +43,56 @@ ACHIEVEMENTS = {
     "loyal_member": {"name": "Завсегдатай", "condition": lambda user_data: user_data['days_active'] >= 7}
 }
 
+class XpAccumulator:
+    """
+    Накопитель XP: суммирует начисления по пользователям в памяти
+    и применяет их к базе одной транзакцией при вызове flush().
+    """
+
+    def __init__(self):
+        self._pending = {}  # user_id -> накопленный XP
+        self._chats = {}    # user_id -> chat_id для уведомлений
+        self._lock = threading.Lock()  # flush() выполняется в потоке базы, add() - в цикле событий
+
+    def add(self, user_id: int, amount: int, chat_id: int | None = None):
+        """
+        Добавляет XP пользователю в накопитель.
+        """
+        with self._lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + amount
+            if chat_id is not None:
+                self._chats[user_id] = chat_id
+
+    def flush(self) -> tuple[dict[int, tuple[int, int, int]], dict[int, int]]:
+        """
+        Применяет накопленный XP к базе. Возвращает результаты начисления
+        {user_id: (old_level, new_level, new_xp)} и чаты для уведомлений {user_id: chat_id}.
+        """
+        with self._lock:
+            pending, chats = self._pending, self._chats
+            self._pending, self._chats = {}, {}
+
+        if not pending:
+            return {}, chats
+
+        try:
+            results = add_xp_batch(pending)
+        except Exception:
+            # Возвращаем XP в накопитель, чтобы применить его при следующей попытке
+            with self._lock:
+                for user_id, amount in pending.items():
+                    self._pending[user_id] = self._pending.get(user_id, 0) + amount
+                for user_id, chat_id in chats.items():
+                    # Более свежий чат, добавленный во время записи, не затираем
+                    self._chats.setdefault(user_id, chat_id)
+            raise
+
+        return results, chats
+
+
+xp_accumulator = XpAccumulator()
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработчик сообщений для начисления XP
@@ -61,11 +100,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Проверяем, что сообщение отправлено в привязанной группе
-    chat_id = update.effective_chat.id
-    from database import get_bound_supergroup_id
-    bound_supergroup_id = get_bound_supergroup_id()
-    
-    if update.effective_chat.type not in ['group', 'supergroup'] or chat_id != bound_supergroup_id:
+    if not is_bound_supergroup(update.effective_chat):
         return  # Игнорировать сообщения, не из привязанной супергруппы
     
     # Проверяем кулдаун
@@ -75,48 +110,74 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if time_since_last_xp < COOLDOWN_SECONDS:
             return  # Не начисляем XP, если прошло мало времени
     
-    # Начисляем XP
-    new_level, new_xp = add_xp(user_id, XP_PER_MESSAGE)
+    # Начисляем XP (в базу попадет при следующей пакетной записи)
+    xp_accumulator.add(user_id, XP_PER_MESSAGE, update.effective_chat.id)
     last_xp_time[user_id] = current_time
     
     # Обновляем статистику сообщений пользователя
     if 'messages_sent' not in context.user_data:
         context.user_data['messages_sent'] = 0
     context.user_data['messages_sent'] += 1
-    
-    # Проверяем, открыл ли пользователь новое достижение
-    await check_achievements(update, context, user_id, new_level)
 
-async def check_achievements(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, current_level: int):
+async def flush_xp(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Фоновая задача: пакетно записывает накопленный XP и отправляет уведомления
+    о новых уровнях и достижениях
+    """
+    try:
+        results, chats = await run_in_db(xp_accumulator.flush)
+    except Exception as e:
+        logger.error(f'Ошибка при пакетном начислении XP: {e}')
+        return
+    
+    for user_id, (old_level, new_level, new_xp) in results.items():
+        chat_id = chats.get(user_id)
+        if chat_id is None:
+            continue
+        
+        try:
+            if new_level > old_level:
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"⬆️ Пользователь {user_id} достиг {new_level} уровня ({get_level_title(new_level)})!"
+                )
+            
+            # Проверяем, открыл ли пользователь новое достижение
+            user_data = context.application.user_data.get(user_id, {})
+            await check_achievements(context, chat_id, user_id, new_level, user_data)
+        except Exception as e:
+            logger.error(f'Не удалось отправить уведомление пользователю {user_id}: {e}')
+
+async def check_achievements(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, current_level: int, stats: dict):
     """
     Проверяет, открыл ли пользователь новые достижения
     """
-    # Получаем текущие данные пользователя для проверки достижений
-    level, xp, balance = get_user_profile(user_id)
-    
     # Обновляем данные пользователя для проверки условий
     user_data = {
         'level': current_level,
-        'messages_sent': context.user_data.get('messages_sent', 0),
-        'games_played': context.user_data.get('games_played', 0),
-        'games_won': context.user_data.get('games_won', 0),
+        'messages_sent': stats.get('messages_sent', 0),
+        'games_played': stats.get('games_played', 0),
+        'games_won': stats.get('games_won', 0),
         'is_top_10': False,  # Это условие требует дополнительной проверки
-        'days_active': context.user_data.get('days_active', 0)
+        'days_active': stats.get('days_active', 0)
     }
     
+    # Получаем достижения пользователя один раз
+    user_achievements = await get_user_achievements(user_id)
+    
     # Проверяем все достижения
     for achievement_id, achievement_info in ACHIEVEMENTS.items():
         # Проверяем, есть ли у пользователя это достижение
-        user_achievements = get_user_achievements(user_id)
         if achievement_id not in user_achievements:
             # Проверяем, выполнено ли условие для получения достижения
             if achievement_info['condition'](user_data):
                 # Начисляем достижение
-                grant_achievement(user_id, achievement_id)
+                await grant_achievement(user_id, achievement_id)
                 
                 # Отправляем поздравительное сообщение
-                await update.message.reply_text(
-                    f"🎉 Поздравляем! Вы получили достижение: {achievement_info['name']}!"
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"🎉 Поздравляем! Вы получили достижение: {achievement_info['name']}!"
                 )
 
 def get_level_title(level: int) -> str:
@@ -133,7 +194,7 @@ def format_xp_progress(level: int, xp: int) -> str:
     Форматирует прогресс XP в виде строки с визуальным прогресс-баром
     """
     # Рассчитываем максимальный XP для текущего уровня
-    max_xp_for_level = level * XP_LEVEL_THRESHOLD
+    max_xp_for_level = level_curve.xp_to_next(level)
     progress = min(int((xp / max_xp_for_level) * 10), 10)  # От 0 до 10
     
     # Создаем прогресс-бар
@@ -148,10 +209,10 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Получаем данные профиля
-    level, xp, balance = get_user_profile(user_id)
+    level, xp, balance = await get_user_profile(user_id)
     
     # Получаем список достижений
-    achievements = get_user_achievements(user_id)
+    achievements = await get_user_achievements(user_id)
     
     # Получаем звание
     title = get_level_title(level)
@@ -163,7 +224,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     profile_message = f"👤 Профиль пользователя: {update.effective_user.full_name}\n\n"
     profile_message += f"🏆 Уровень: {level} ({title})\n"
     profile_message += f"📊 Опыт: {xp_progress}\n"
-    profile_message += f"💰 Баланс: {balance} LumeCoin\n\n"
+    profile_message += f"💰 Баланс: {format_coins(balance)} LumeCoin\n\n"
     
     if achievements:
         profile_message += "🎖 Достижения:\n"
@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler
+from database import save_display_names, get_display_name_record
+from async_db import run_in_db
+
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', '10000'))  # Сколько имен держим в памяти
+IDENTITY_TTL = int(os.getenv('IDENTITY_TTL', '86400'))  # Время жизни имени в секундах
+IDENTITY_FLUSH_INTERVAL = int(os.getenv('IDENTITY_FLUSH_INTERVAL', '60'))  # Интервал записи имен в базу
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityCache:
+    """
+    LRU-кэш отображаемых имен пользователей с ограниченным временем жизни записей.
+    Новые и изменившиеся имена накапливаются и записываются в users_meta пакетом.
+    """
+
+    def __init__(self, max_size: int = IDENTITY_CACHE_SIZE, ttl: int = IDENTITY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (display_name, время записи по time.monotonic(), проверено ли)
+        self._dirty = {}               # user_id -> (display_name, updated_at) для записи в базу
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, fresh_only: bool = False) -> str | None:
+        """
+        Возвращает имя из кэша или None, если его нет или оно устарело.
+        С fresh_only=True имена, загруженные из базы и еще не подтвержденные
+        обновлением от Telegram, тоже считаются отсутствующими.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            display_name, stored_at, fresh = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[user_id]
+                return None
+            if fresh_only and not fresh:
+                return None
+
+            self._entries.move_to_end(user_id)
+            return display_name
+
+    def put(self, user_id: int, display_name: str, persist: bool = True, fresh: bool = True):
+        """
+        Кладет имя в кэш. Если имя новое или изменилось, помечает его для записи в базу.
+        fresh=False - имя взято из базы и может быть старым: при следующем
+        resolve_display_name() оно будет перепроверено через Telegram.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if persist and (entry is None or entry[0] != display_name or not entry[2]
+                            or time.monotonic() - entry[1] > self.ttl):
+                self._dirty[user_id] = (display_name, datetime.now())
+
+            self._entries[user_id] = (display_name, time.monotonic(), fresh)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные имена в базу одной транзакцией.
+        Возвращает количество записанных имен.
+        """
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = {}
+
+        if not dirty:
+            return 0
+
+        try:
+            save_display_names([(user_id, name, updated_at) for user_id, (name, updated_at) in dirty.items()])
+        except Exception:
+            # Возвращаем записи, не затирая более свежие
+            with self._lock:
+                for user_id, record in dirty.items():
+                    self._dirty.setdefault(user_id, record)
+            raise
+
+        return len(dirty)
+
+
+identity_cache = IdentityCache()
+
+
+def _name_of(user) -> str | None:
+    """
+    Возвращает отображаемое имя объекта пользователя или чата Telegram.
+    """
+    return user.username or user.first_name
+
+
+def remember_user(user):
+    """
+    Запоминает отображаемое имя пользователя Telegram.
+    """
+    name = _name_of(user)
+    if name:
+        identity_cache.put(user.id, name)
+
+
+def _lookup(user_id: int) -> str | None:
+    """
+    Ищет имя в кэше, затем в базе. Имя из базы кладется в кэш как непроверенное.
+    """
+    name = identity_cache.get(user_id)
+    if name:
+        return name
+
+    record = get_display_name_record(user_id)
+    if record is None:
+        return None
+
+    name, _ = record
+    identity_cache.put(user_id, name, persist=False, fresh=False)
+    return name
+
+
+async def get_display_name(user_id: int) -> str:
+    """
+    Возвращает отображаемое имя пользователя из кэша или базы, без запросов к Telegram.
+    При промахе кэша чтение из базы выполняется в потоке-исполнителе.
+    """
+    name = identity_cache.get(user_id)
+    if not name:
+        name = await run_in_db(_lookup, user_id)
+    return name or f'ID: {user_id}'
+
+
+async def resolve_display_name(bot, user_id: int) -> str:
+    """
+    Возвращает отображаемое имя пользователя. Запрос get_chat к Telegram
+    выполняется, только если в кэше нет имени, полученного из обновлений Telegram;
+    имя из базы используется, если запрос не удался.
+    """
+    name = identity_cache.get(user_id, fresh_only=True)
+    if name:
+        return name
+
+    name = await run_in_db(_lookup, user_id)
+
+    try:
+        chat = await bot.get_chat(user_id)
+    except Exception:
+        return name or f'ID: {user_id}'
+
+    fresh_name = _name_of(chat)
+    if fresh_name:
+        identity_cache.put(user_id, fresh_name)
+        return fresh_name
+    return name or f'ID: {user_id}'
+
+
+async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик, который пассивно собирает имена авторов всех обновлений
+    и авторов сообщений, на которые они отвечают.
+    """
+    if update.effective_user:
+        remember_user(update.effective_user)
+
+    message = update.effective_message
+    if message and message.reply_to_message and message.reply_to_message.from_user:
+        remember_user(message.reply_to_message.from_user)
+
+
+async def flush_identities(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Фоновая задача: записывает новые и изменившиеся имена в базу.
+    """
+    try:
+        await run_in_db(identity_cache.flush)
+    except Exception as e:
+        logger.error(f'Ошибка при записи имен пользователей: {e}')
+
+
+# Регистрируется в группе -1, чтобы срабатывать до остальных обработчиков
+user_tracker_handler = TypeHandler(Update, track_user)
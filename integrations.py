@@ -1,7 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from database import get_user_balance, update_user_balance, get_user_discount_tier, set_user_discount_tier, get_available_vpn_code, add_vpn_codes
+from money import to_cents, format_coins
+from async_db import get_user_balance, update_user_balance, debit_if_sufficient, get_user_discount_tier, set_user_discount_tier, get_available_vpn_code, add_vpn_codes
 import logging
+from locks import serialized_per_user
 
 def get_user_id(update: Update) -> int:
     """Получение ID пользователя из обновления"""
@@ -29,6 +31,7 @@ async def shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text('🛒 Выберите уровень скидки:', reply_markup=reply_markup)
 
+@serialized_per_user
 async def discount_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка нажатий на кнопки покупки скидки"""
     query = update.callback_query
@@ -39,9 +42,9 @@ async def discount_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Определяем уровень скидки и стоимость
     discount_mapping = {
-        'discount_5': (5, 5000),
-        'discount_10': (10, 10000),
-        'discount_20': (20, 20000)
+        'discount_5': (5, to_cents(5000)),
+        'discount_10': (10, to_cents(10000)),
+        'discount_20': (20, to_cents(20000))
     }
 
     if callback_data not in discount_mapping:
@@ -50,15 +53,13 @@ async def discount_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     discount_tier, cost = discount_mapping[callback_data]
 
-    # Проверяем баланс пользователя
-    current_balance = get_user_balance(user_id)
-    if current_balance < cost:
-        await query.edit_message_text(f'❌ Недостаточно средств. Ваш баланс: {current_balance} LumeCoin')
+    # Списываем средства, только если их хватает, и устанавливаем уровень скидки
+    if await debit_if_sufficient(user_id, cost, reason='discount') is None:
+        current_balance = await get_user_balance(user_id)
+        await query.edit_message_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(current_balance)} LumeCoin')
         return
 
-    # Списываем средства и устанавливаем уровень скидки
-    update_user_balance(user_id, current_balance - cost)
-    set_user_discount_tier(user_id, discount_tier)
+    await set_user_discount_tier(user_id, discount_tier)
 
     await query.edit_message_text(f'✅ Вы приобрели скидку {discount_tier}%. Средства списаны.')
 
@@ -73,6 +74,7 @@ async def vpn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text('🛒 Выберите период VPN:', reply_markup=reply_markup)
 
+@serialized_per_user
 async def vpn_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка нажатий на кнопки покупки VPN"""
     query = update.callback_query
@@ -83,9 +85,9 @@ async def vpn_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Определяем тип VPN и стоимость
     vpn_mapping = {
-        'vpn_1w': ('1w', 3000, '1 неделю'),
-        'vpn_1m': ('1m', 10000, '1 месяц'),
-        'vpn_3m': ('3m', 25000, '3 месяца')
+        'vpn_1w': ('1w', to_cents(3000), '1 неделю'),
+        'vpn_1m': ('1m', to_cents(10000), '1 месяц'),
+        'vpn_3m': ('3m', to_cents(25000), '3 месяца')
     }
 
     if callback_data not in vpn_mapping:
@@ -94,21 +96,19 @@ async def vpn_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     vpn_type, cost, period = vpn_mapping[callback_data]
 
-    # Проверяем баланс пользователя
-    current_balance = get_user_balance(user_id)
-    if current_balance < cost:
-        await query.edit_message_text(f'❌ Недостаточно средств. Ваш баланс: {current_balance} LumeCoin')
+    # Сначала списываем средства (только если их хватает), чтобы промокод не выдавался без оплаты
+    if await debit_if_sufficient(user_id, cost, reason='vpn') is None:
+        current_balance = await get_user_balance(user_id)
+        await query.edit_message_text(f'❌ Недостаточно средств. Ваш баланс: {format_coins(current_balance)} LumeCoin')
         return
 
-    # Проверяем наличие доступных промокодов
-    vpn_code = get_available_vpn_code(vpn_type)
+    # Выдаем промокод; если их не осталось, возвращаем списанные средства
+    vpn_code = await get_available_vpn_code(vpn_type, user_id)
     if not vpn_code:
+        await update_user_balance(user_id, cost, reason='vpn')
         await query.edit_message_text('❌ К сожалению, в данный момент нет доступных промокодов.')
         return
 
-    # Списываем средства
-    update_user_balance(user_id, current_balance - cost)
-
     # Отправляем промокод пользователю
     await query.edit_message_text(f'Ваш промокод на {period}: `{vpn_code}`. Активировать в @NaizekVPN_bot.', parse_mode='Markdown')
 
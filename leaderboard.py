@@ -0,0 +1,103 @@
+import heapq
+import os
+import threading
+from collections.abc import Callable
+
+LEADERBOARD_CAPACITY = int(os.getenv('LEADERBOARD_CAPACITY', '100'))  # Сколько лидеров держим в памяти
+
+
+class Leaderboard:
+    """
+    Топ пользователей по балансу, который хранится в памяти и обновляется
+    при каждом изменении баланса.
+
+    Инвариант: у любого пользователя вне таблицы баланс не больше threshold,
+    поэтому top(n) точен, пока в таблице не меньше n записей. Если записей
+    не хватает (лидеры потратили монеты), top() возвращает None и таблицу
+    нужно перезагрузить из базы через load().
+    """
+
+    def __init__(self, capacity: int = LEADERBOARD_CAPACITY):
+        self.capacity = capacity
+        self._balances = {}       # user_id -> баланс для пользователей в таблице
+        self._threshold = None    # Верхняя граница баланса пользователей вне таблицы
+        self._complete = False    # True, если в таблицу попали все пользователи из базы
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, rows: list[tuple[int, int]]):
+        """
+        Заполняет таблицу строками (user_id, balance), отсортированными по убыванию баланса
+        и ограниченными capacity.
+        """
+        with self._lock:
+            self._fill(rows)
+
+    def reload(self, fetch: Callable[[int], list[tuple[int, int]]]):
+        """
+        Перезагружает таблицу строками, которые возвращает fetch(capacity).
+        Блокировка держится на время всей выборки: изменения баланса, зафиксированные
+        во время выборки, применяются после замены таблицы, а не теряются.
+        """
+        with self._lock:
+            self._fill(fetch(self.capacity))
+
+    def _fill(self, rows: list[tuple[int, int]]):
+        """
+        Заполняет таблицу строками; вызывается под блокировкой.
+        """
+        self._balances = {user_id: balance for user_id, balance in rows}
+        self._complete = len(rows) < self.capacity
+        self._threshold = None if self._complete else rows[-1][1]
+        self._loaded = True
+
+    def invalidate(self):
+        """
+        Сбрасывает таблицу; при следующем запросе топа она будет загружена из базы.
+        """
+        with self._lock:
+            self._loaded = False
+
+    def update(self, user_id: int, balance: int):
+        """
+        Учитывает новый баланс пользователя.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+
+            if self._threshold is not None and balance < self._threshold:
+                # Пользователь опустился ниже границы: вне таблицы инвариант сохраняется
+                self._balances.pop(user_id, None)
+                return
+
+            self._balances[user_id] = balance
+
+            if len(self._balances) > self.capacity:
+                # Вытесняем самого бедного; граница поднимается до его баланса
+                evicted_id = min(self._balances, key=self._balances.get)
+                evicted_balance = self._balances.pop(evicted_id)
+                self._threshold = evicted_balance if self._threshold is None else max(self._threshold, evicted_balance)
+                self._complete = False
+
+    def shift_all(self, delta: int):
+        """
+        Учитывает одинаковое изменение баланса всех пользователей (например, раздачу монет).
+        """
+        with self._lock:
+            self._balances = {user_id: balance + delta for user_id, balance in self._balances.items()}
+            if self._threshold is not None:
+                self._threshold += delta
+
+    def top(self, n: int) -> list[tuple[int, int]] | None:
+        """
+        Возвращает n лидеров [(user_id, balance)] по убыванию баланса
+        или None, если таблицу нужно перезагрузить из базы.
+        """
+        with self._lock:
+            if not self._loaded or n > self.capacity:
+                return None
+            if len(self._balances) < n and not self._complete:
+                return None
+
+            return heapq.nlargest(n, self._balances.items(), key=lambda item: item[1])
@@ -0,0 +1,67 @@
+import os
+from math import isqrt
+
+# Кривая уровней: для перехода с уровня L на L+1 нужно base + step * (L - 1) XP.
+# При base = step = 500 это прежнее правило "level * 500".
+XP_LEVEL_BASE = int(os.getenv('XP_LEVEL_BASE', '500'))
+XP_LEVEL_STEP = int(os.getenv('XP_LEVEL_STEP', '500'))
+
+
+class LevelCurve:
+    """
+    Арифметическая кривая уровней с расчетом уровня по опыту за O(1).
+    Уровни начинаются с 1, опыт внутри уровня хранится отдельно от уровня.
+    """
+
+    def __init__(self, base: int = XP_LEVEL_BASE, step: int = XP_LEVEL_STEP):
+        if base <= 0 or step < 0:
+            raise ValueError('base должен быть положительным, step - неотрицательным')
+        self.base = base
+        self.step = step
+
+    def xp_to_next(self, level: int) -> int:
+        """
+        Возвращает опыт, необходимый для перехода с уровня level на следующий.
+        """
+        return self.base + self.step * (level - 1)
+
+    def total_xp(self, level: int) -> int:
+        """
+        Возвращает суммарный опыт, необходимый для достижения уровня level с 1-го уровня.
+        """
+        n = level - 1
+        return n * self.base + self.step * n * (n - 1) // 2
+
+    def level_for_total(self, total: int) -> int:
+        """
+        Возвращает уровень, соответствующий суммарному опыту total.
+        Решает квадратное неравенство total_xp(level) <= total через целочисленный корень.
+        """
+        if total <= 0:
+            return 1
+        if self.step == 0:
+            return total // self.base + 1
+
+        # step * n^2 + (2 * base - step) * n - 2 * total <= 0, где n = level - 1
+        b = 2 * self.base - self.step
+        n = (isqrt(b * b + 8 * self.step * total) - b) // (2 * self.step)
+
+        # Поправка на погрешность целочисленного корня (не более одного шага)
+        while self.total_xp(n + 2) <= total:
+            n += 1
+        while n > 0 and self.total_xp(n + 1) > total:
+            n -= 1
+
+        return n + 1
+
+    def apply(self, level: int, xp: int, amount: int) -> tuple[int, int]:
+        """
+        Добавляет amount опыта к уровню level с опытом xp внутри уровня.
+        Возвращает кортеж (new_level, new_xp).
+        """
+        total = self.total_xp(level) + xp + amount
+        new_level = max(self.level_for_total(total), level)
+        return new_level, total - self.total_xp(new_level)
+
+
+level_curve = LevelCurve()
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+
+
+class UserLockRegistry:
+    """
+    Реестр блокировок по user_id. Операции с балансом одного пользователя
+    выполняются строго по очереди, разные пользователи обрабатываются параллельно.
+    Блокировки хранятся в WeakValueDictionary и удаляются, когда их никто не держит и не ждет.
+    """
+
+    def __init__(self):
+        self._async_locks = weakref.WeakValueDictionary()   # Для обработчиков бота (asyncio)
+        self._thread_locks = weakref.WeakValueDictionary()  # Для потоков веб-API (Flask)
+        self._guard = threading.Lock()
+
+    def async_lock(self, user_id: int) -> asyncio.Lock:
+        """
+        Возвращает asyncio-блокировку пользователя.
+        """
+        with self._guard:
+            lock = self._async_locks.get(user_id)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._async_locks[user_id] = lock
+            return lock
+
+    def thread_lock(self, user_id: int) -> threading.Lock:
+        """
+        Возвращает потоковую блокировку пользователя.
+        """
+        with self._guard:
+            lock = self._thread_locks.get(user_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._thread_locks[user_id] = lock
+            return lock
+
+    @asynccontextmanager
+    async def hold(self, *user_ids: int):
+        """
+        Захватывает блокировки нескольких пользователей (например, отправителя и получателя).
+        Блокировки берутся по возрастанию user_id, чтобы встречные операции не взаимоблокировались.
+        """
+        locks = [self.async_lock(user_id) for user_id in sorted(set(user_ids))]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    @contextmanager
+    def hold_sync(self, *user_ids: int):
+        """
+        То же, что hold(), для синхронного кода (потоков веб-API).
+        """
+        locks = [self.thread_lock(user_id) for user_id in sorted(set(user_ids))]
+        acquired = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+
+user_locks = UserLockRegistry()
+
+
+def serialized_per_user(func):
+    """
+    Декоратор для обработчиков, меняющих баланс: обработчики одного пользователя
+    выполняются по очереди, даже если включена параллельная обработка обновлений.
+    """
+    @wraps(func)
+    async def wrapper(update, context):
+        async with user_locks.hold(update.effective_user.id):
+            return await func(update, context)
+    return wrapper
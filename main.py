@@ -1,16 +1,38 @@
+import asyncio
 import os
-from functools import wraps
+import logging
+from datetime import datetime, timedelta
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram import Update
-from database import initialize_database, get_bound_supergroup_id, set_bound_supergroup_id, get_all_admin_ids, add_admin, remove_admin, get_user_balance, update_user_balance, get_top_users_by_balance, add_vpn_codes, add_referral, get_referrer_id, get_referral_reward_status, mark_referral_reward_as_claimed, get_inactive_users, add_interaction
+from telegram.request import HTTPXRequest
+from money import to_cents, parse_coins, format_coins
+from database import DEFAULT_BALANCE, initialize_database, queue_interaction, close_database, DB_CHECKPOINT_INTERVAL, ACTIVITY_FLUSH_INTERVAL, LEADERBOARD_RELOAD_INTERVAL, LEDGER_SNAPSHOT_INTERVAL, LEDGER_RETENTION_DAYS
+from async_db import set_bound_supergroup_id, get_all_admin_ids, add_admin, remove_admin, get_user_balance, update_user_balance, transfer, get_top_users_by_balance, reload_leaderboard, add_vpn_codes, add_referral, get_referrer_id, get_referral_reward_status, mark_referral_reward_as_claimed, flush_interactions, checkpoint_wal, snapshot_balances, compact_ledger, run_in_db
+from async_db import shutdown as shutdown_db_executor
 
 # Загрузка переменных окружения
 from dotenv import load_dotenv
 load_dotenv()
+from decorators import group_only, owner_only, admin_only, is_admin
+from locks import user_locks, serialized_per_user
 from games import roulette, play, russian, jewish, dice, slots
-from gamification import xp_handler, profile_handler
+from gamification import xp_handler, profile_handler, flush_xp, xp_accumulator, XP_FLUSH_INTERVAL
 from titles import buytitle_command, renttitle_command, check_expired_titles, titles_command
 from admin_panel import register_admin_handlers
+from broadcast import resume_broadcasts, stop_broadcasts
+from reminders import send_reminders
+from deletion import deletion_scheduler, process_deletions, DELETION_TICK
+from identity import user_tracker_handler, get_display_name, resolve_display_name, identity_cache, flush_identities, IDENTITY_FLUSH_INTERVAL
+
+# Профиль выполнения бота: параллельная обработка обновлений и пул HTTP-соединений
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '32'))  # Обновлений, обрабатываемых одновременно (1 - последовательно)
+BOT_CONNECTION_POOL_SIZE = int(os.getenv('BOT_CONNECTION_POOL_SIZE', '64'))  # Соединений для запросов к Bot API
+BOT_CONNECT_TIMEOUT = float(os.getenv('BOT_CONNECT_TIMEOUT', '5'))
+BOT_READ_TIMEOUT = float(os.getenv('BOT_READ_TIMEOUT', '10'))
+BOT_WRITE_TIMEOUT = float(os.getenv('BOT_WRITE_TIMEOUT', '10'))
+BOT_POOL_TIMEOUT = float(os.getenv('BOT_POOL_TIMEOUT', '5'))  # Ожидание свободного соединения из пула
+BOT_POLL_TIMEOUT = int(os.getenv('BOT_POLL_TIMEOUT', '30'))  # Long polling: сколько Telegram держит запрос getUpdates
+BOT_GET_UPDATES_READ_TIMEOUT = float(os.getenv('BOT_GET_UPDATES_READ_TIMEOUT', '5'))  # Добавляется к BOT_POLL_TIMEOUT
 
 # Команда для привязки группы (добавлена для корректной работы)
 async def bindgroup(update, context):
@@ -24,12 +46,10 @@ async def bindgroup(update, context):
     chat_id = update.effective_chat.id
     
     # Сохраняем ID супергруппы в базу данных
-    set_bound_supergroup_id(chat_id)
+    await set_bound_supergroup_id(chat_id)
     
     await update.message.reply_text(f'✅ Супергруппа привязана: {chat_id}')
 
-OWNER_ID = int(os.getenv('OWNER_ID', '8415112409'))
-
 
 async def help_command(update, context):
     """Команда /help для отображения списка всех команд"""
@@ -69,59 +89,6 @@ async def help_command(update, context):
     await update.message.reply_text(help_message, parse_mode='HTML')
 
 
-def owner_only(func):
-    """
-    Декоратор, который проверяет, является ли автор сообщения владельцем.
-    """
-    @wraps(func)
-    async def wrapper(update, context):
-        user_id = update.effective_user.id
-        if user_id != OWNER_ID:
-            return # Игнорировать команду, если пользователь не является владельцем
-        return await func(update, context)
-    return wrapper
-
-
-def is_admin(user_id: int) -> bool:
-    """
-    Проверяет, является ли пользователь владельцем или есть в списке администраторов.
-    """
-    if user_id == OWNER_ID:
-        return True
-    admin_ids = get_all_admin_ids()
-    return user_id in admin_ids
-
-
-def admin_only(func):
-    """
-    Декоратор, использующий is_admin() для проверки прав.
-    """
-    @wraps(func)
-    async def wrapper(update, context):
-        user_id = update.effective_user.id
-        if not is_admin(user_id):
-            return  # Игнорировать команду, если пользователь не является администратором
-        return await func(update, context)
-    return wrapper
-
-
-def group_only(func):
-    """
-    Декоратор, который проверяет, что команда вызвана в привязанной супергруппе.
-    """
-    @wraps(func)
-    async def wrapper(update, context):
-        chat_id = update.effective_chat.id
-        bound_supergroup_id = get_bound_supergroup_id()
-        
-        # Проверяем, что чат - это привязанная супергруппа
-        if update.effective_chat.type not in ['group', 'supergroup'] or chat_id != bound_supergroup_id:
-            return  # Игнорировать команду, если она вызвана не в привязанной супергруппе
-        
-        return await func(update, context)
-    return wrapper
-
-
 async def start(update, context):
     """Обновленная команда /start, проверяющая существование пользователя и выводящая баланс"""
     user_id = update.effective_user.id
@@ -137,26 +104,26 @@ async def start(update, context):
                 referrer_id = None
     
     # Проверяем существование пользователя и создаем при необходимости
-    balance = get_user_balance(user_id)
+    balance = await get_user_balance(user_id)
     
     # Проверяем, является ли пользователь новым (баланс равен начальному значению)
-    is_new_user = balance == 100.0  # Предполагаем, что начальный баланс 100.0
+    is_new_user = balance == DEFAULT_BALANCE
     
     if referrer_id and is_new_user:
         # Проверяем, что пользователь еще не имеет реферера
-        existing_referrer = get_referrer_id(user_id)
+        existing_referrer = await get_referrer_id(user_id)
         if existing_referrer is None:
             # Добавляем запись о реферале
-            add_referral(user_id, referrer_id)
+            await add_referral(user_id, referrer_id)
             
             # Начисляем бонусы
-            update_user_balance(user_id, 200.0)  # +200 LumeCoin новому пользователю
-            update_user_balance(referrer_id, 100.0) # +100 LumeCoin пригласившему
+            await update_user_balance(user_id, to_cents(200), reason='referral')  # +200 LumeCoin новому пользователю
+            await update_user_balance(referrer_id, to_cents(100), reason='referral') # +100 LumeCoin пригласившему
             
             # Отправляем приветственное сообщение с упоминанием бонуса
             welcome_message = (
                 f'👋 Добро пожаловать в VapeLume Kazino!\n'
-                f'💰 Ваш начальный баланс: {get_user_balance(user_id):.1f} LumeCoin\n\n'
+                f'💰 Ваш начальный баланс: {format_coins(await get_user_balance(user_id))} LumeCoin\n\n'
                 f'🎁 Вы получили 200 LumeCoin за регистрацию по реферальной ссылке!'
             )
             await update.message.reply_text(welcome_message)
@@ -172,40 +139,35 @@ async def start(update, context):
                 pass
         else:
             # Если у пользователя уже есть реферер, просто приветствуем
-            welcome_message = f'👋 Добро пожаловать в VapeLume Kazino!\n💰 Ваш баланс: {balance:.1f} LumeCoin'
+            welcome_message = f'👋 Добро пожаловать в VapeLume Kazino!\n💰 Ваш баланс: {format_coins(balance)} LumeCoin'
             await update.message.reply_text(welcome_message)
     else:
         # Обычное приветствие
-        welcome_message = f'👋 Добро пожаловать в VapeLume Kazino!\n💰 Ваш начальный баланс: {balance:.1f} LumeCoin'
+        welcome_message = f'👋 Добро пожаловать в VapeLume Kazino!\n💰 Ваш начальный баланс: {format_coins(balance)} LumeCoin'
         await update.message.reply_text(welcome_message)
 
 
 async def balance(update, context):
     """Команда /balance для проверки баланса пользователя"""
     user_id = update.effective_user.id
-    balance = get_user_balance(user_id)
+    balance = await get_user_balance(user_id)
     
-    await update.message.reply_text(f'💰 Ваш баланс: {balance:.1f} LumeCoin')
+    await update.message.reply_text(f'💰 Ваш баланс: {format_coins(balance)} LumeCoin')
 
 
 async def top(update, context):
     """Команда /top для вывода топа пользователей по балансу"""
-    top_users = get_top_users_by_balance(10)
+    top_users = await get_top_users_by_balance(10)
     
     if not top_users:
         await update.message.reply_text('📊 Рейтинг пользователей пока пуст.')
         return
     
-    # Формируем сообщение с рейтингом
+    # Формируем сообщение с рейтингом (имена берутся из кэша или базы, без запросов к Telegram)
+    names = await asyncio.gather(*(get_display_name(user_id) for user_id, _ in top_users))
     top_message = '🏆 Топ пользователей по балансу:\n\n'
-    for i, (user_id, balance) in enumerate(top_users, 1):
-        try:
-            user = await context.bot.get_chat(user_id)
-            username = user.username or user.first_name or f'ID: {user_id}'
-        except Exception:
-            username = f'ID: {user_id}'
-        
-        top_message += f'{i}. {username} - {balance:.1f} LumeCoin\n'
+    for i, ((user_id, balance), name) in enumerate(zip(top_users, names), 1):
+        top_message += f'{i}. {name} - {format_coins(balance)} LumeCoin\n'
     
     await update.message.reply_text(top_message)
 
@@ -232,33 +194,27 @@ async def pay(update, context):
         await update.message.reply_text('❌ Укажите сумму перевода: /pay <сумма>')
         return
     
-    try:
-        amount = float(context.args[0])
-        if amount <= 0:
-            await update.message.reply_text('❌ Сумма перевода должна быть больше 0.')
-            return
-    except ValueError:
+    amount = parse_coins(context.args[0])
+    if amount is None:
         await update.message.reply_text('❌ Некорректная сумма. Укажите число: /pay <сумма>')
         return
-    
-    # Проверяем, достаточно ли средств у отправителя
-    sender_balance = get_user_balance(user_id)
-    if sender_balance < amount:
-        await update.message.reply_text(f'❌ Недостаточно средств для перевода. Ваш баланс: {sender_balance:.1f} LumeCoin')
+    if amount <= 0:
+        await update.message.reply_text('❌ Сумма перевода должна быть больше 0.')
         return
     
-    # Выполняем перевод
-    update_user_balance(user_id, -amount)  # Списание у отправителя
-    update_user_balance(recipient_user_id, amount) # Зачисление получателю
+    # Списание и зачисление - одной транзакцией. Ключ идемпотентности по ID сообщения
+    # не дает провести перевод дважды, если Telegram доставит обновление повторно
+    idempotency_key = f'pay:{update.effective_chat.id}:{update.message.message_id}'
+    result = await transfer(user_id, recipient_user_id, amount, idempotency_key)
+    if result is None:
+        sender_balance = await get_user_balance(user_id)
+        await update.message.reply_text(f'❌ Недостаточно средств для перевода. Ваш баланс: {format_coins(sender_balance)} LumeCoin')
+        return
     
     # Подтверждение перевода
-    try:
-        recipient_user = await context.bot.get_chat(recipient_user_id)
-        recipient_name = recipient_user.username or recipient_user.first_name or f'ID: {recipient_user_id}'
-    except Exception:
-        recipient_name = f'ID: {recipient_user_id}'
+    recipient_name = await resolve_display_name(context.bot, recipient_user_id)
     
-    await update.message.reply_text(f'✅ Успешный перевод!\nПереведено {amount:.1f} LumeCoin пользователю {recipient_name}.')
+    await update.message.reply_text(f'✅ Успешный перевод!\nПереведено {format_coins(amount)} LumeCoin пользователю {recipient_name}.')
 
 
 @admin_only
@@ -276,26 +232,22 @@ async def give(update, context):
         await update.message.reply_text('❌ Укажите сумму для начисления: /give <сумма>')
         return
     
-    try:
-        amount = float(context.args[0])
-        if amount <= 0:
-            await update.message.reply_text('❌ Сумма должна быть больше 0.')
-            return
-    except ValueError:
+    amount = parse_coins(context.args[0])
+    if amount is None:
         await update.message.reply_text('❌ Некорректная сумма. Укажите число: /give <сумма>')
         return
+    if amount <= 0:
+        await update.message.reply_text('❌ Сумма должна быть больше 0.')
+        return
     
-    # Начисляем средства
-    update_user_balance(recipient_user_id, amount)
+    async with user_locks.hold(recipient_user_id):
+        # Начисляем средства
+        await update_user_balance(recipient_user_id, amount, reason='give')
     
     # Подтверждение
-    try:
-        recipient_user = await context.bot.get_chat(recipient_user_id)
-        recipient_name = recipient_user.username or recipient_user.first_name or f'ID: {recipient_user_id}'
-    except Exception:
-        recipient_name = f'ID: {recipient_user_id}'
+    recipient_name = await resolve_display_name(context.bot, recipient_user_id)
     
-    await update.message.reply_text(f'✅ Администратор начислил {amount:.1f} LumeCoin пользователю {recipient_name}.')
+    await update.message.reply_text(f'✅ Администратор начислил {format_coins(amount)} LumeCoin пользователю {recipient_name}.')
 
 
 @admin_only
@@ -313,29 +265,26 @@ async def getback(update, context):
         await update.message.reply_text('❌ Укажите сумму для списания: /getback <сумма>')
         return
     
-    try:
-        amount = float(context.args[0])
-        if amount <= 0:
-            await update.message.reply_text('❌ Сумма должна быть больше 0.')
-            return
-    except ValueError:
+    amount = parse_coins(context.args[0])
+    if amount is None:
         await update.message.reply_text('❌ Некорректная сумма. Укажите число: /getback <сумма>')
         return
+    if amount <= 0:
+        await update.message.reply_text('❌ Сумма должна быть больше 0.')
+        return
     
-    # Списание средств (с передачей отрицательного значения)
-    update_user_balance(recipient_user_id, -amount)
+    async with user_locks.hold(recipient_user_id):
+        # Списание средств (с передачей отрицательного значения)
+        await update_user_balance(recipient_user_id, -amount, reason='admin')
     
     # Подтверждение
-    try:
-        recipient_user = await context.bot.get_chat(recipient_user_id)
-        recipient_name = recipient_user.username or recipient_user.first_name or f'ID: {recipient_user_id}'
-    except Exception:
-        recipient_name = f'ID: {recipient_user_id}'
+    recipient_name = await resolve_display_name(context.bot, recipient_user_id)
     
-    await update.message.reply_text(f'✅ Администратор списал {amount:.1f} LumeCoin у пользователя {recipient_name}.')
+    await update.message.reply_text(f'✅ Администратор списал {format_coins(amount)} LumeCoin у пользователя {recipient_name}.')
 
 
 @admin_only
+@serialized_per_user
 async def getbalance(update, context):
     """Админ-команда /getbalance для начисления LumeCoin администратору"""
     user_id = update.effective_user.id
@@ -345,19 +294,18 @@ async def getbalance(update, context):
         await update.message.reply_text('❌ Укажите сумму для начисления: /getbalance <сумма>')
         return
     
-    try:
-        amount = float(context.args[0])
-        if amount <= 0:
-            await update.message.reply_text('❌ Сумма должна быть больше 0.')
-            return
-    except ValueError:
+    amount = parse_coins(context.args[0])
+    if amount is None:
         await update.message.reply_text('❌ Некорректная сумма. Укажите число: /getbalance <сумма>')
         return
+    if amount <= 0:
+        await update.message.reply_text('❌ Сумма должна быть больше 0.')
+        return
     
     # Начисляем средства администратору
-    update_user_balance(user_id, amount)
+    await update_user_balance(user_id, amount, reason='admin')
     
-    await update.message.reply_text(f'✅ Администратор получил {amount:.1f} LumeCoin.')
+    await update.message.reply_text(f'✅ Администратор получил {format_coins(amount)} LumeCoin.')
 
 
 @owner_only
@@ -388,7 +336,7 @@ async def addadmin(update, context):
         return
     
     # Добавляем администратора
-    add_admin(user_id)
+    await add_admin(user_id)
     await update.message.reply_text(f'✅ Пользователь {user_id} добавлен в администраторы.')
 
 
@@ -420,7 +368,7 @@ async def deladmin(update, context):
         return
     
     # Удаляем администратора
-    remove_admin(user_id)
+    await remove_admin(user_id)
     await update.message.reply_text(f'✅ Пользователь {user_id} удален из администраторов.')
 
 
@@ -429,7 +377,7 @@ async def listadmins(update, context):
     """
     Команда для вывода списка администраторов.
     """
-    admin_ids = get_all_admin_ids()
+    admin_ids = await get_all_admin_ids()
     
     if not admin_ids:
         await update.message.reply_text('📋 Список администраторов пуст.')
@@ -445,8 +393,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    # Обновляем время последнего взаимодействия пользователя
-    add_interaction(user_id)
+    # Обновляем время последнего взаимодействия пользователя (запись в базу - пакетом по таймеру)
+    queue_interaction(user_id)
     
     # Если сообщение отправлено в группу, также обновляем время взаимодействия в группе
     if update.effective_chat.type in ['group', 'supergroup']:
@@ -454,31 +402,103 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass # Реализация зависит от структуры БД
 
 
-def send_reminders(context):
-    """Отправляет напоминания неактивным пользователям"""
-    inactive_users = get_inactive_users(days=3)
-    
-    for user_id in inactive_users:
-        try:
-            context.bot.send_message(
-                chat_id=user_id,
-                text="Мы скучаем! Возвращайся в чат, чтобы получить бонус!"
-            )
-        except Exception as e:
-            print(f"Не удалось отправить напоминание пользователю {user_id}: {e}")
+async def checkpoint_database(context):
+    """Периодический чекпоинт WAL-файла базы данных"""
+    try:
+        busy, log_frames, checkpointed = await checkpoint_wal()
+        if busy:
+            logging.info(f'Чекпоинт WAL выполнен частично: {checkpointed}/{log_frames} страниц')
+    except Exception as e:
+        logging.error(f'Ошибка при чекпоинте WAL: {e}')
+
+
+async def flush_activity(context):
+    """Периодическая запись буфера активности пользователей в базу"""
+    try:
+        await flush_interactions()
+    except Exception as e:
+        logging.error(f'Ошибка при записи активности пользователей: {e}')
+
+
+async def refresh_leaderboard(context):
+    """Периодическая перезагрузка топа из базы (учитывает изменения баланса через веб-API)"""
+    try:
+        await reload_leaderboard()
+    except Exception as e:
+        logging.error(f'Ошибка при обновлении таблицы лидеров: {e}')
+
+
+async def maintain_ledger(context):
+    """Периодический снимок балансов и удаление учтенных в снимках старых записей журнала"""
+    try:
+        snapshots = await snapshot_balances()
+        deleted = await compact_ledger(datetime.now() - timedelta(days=LEDGER_RETENTION_DAYS))
+        logging.info(f'Журнал монет: обновлено снимков {snapshots}, удалено записей {deleted}')
+    except Exception as e:
+        logging.error(f'Ошибка при обслуживании журнала монет: {e}')
+
+
+async def on_shutdown(application):
+    """Сбрасывает буферы в базу и закрывает соединения при остановке бота"""
+    await flush_interactions()
+    await run_in_db(xp_accumulator.flush)
+    await run_in_db(identity_cache.flush)
+    await run_in_db(deletion_scheduler.persist)
+    # Дожидаемся завершения запросов в потоках-исполнителях до закрытия пула
+    shutdown_db_executor()
+    close_database()
+
+
+def build_application(token: str) -> Application:
+    """Собирает приложение с параллельной обработкой обновлений и настроенными HTTP-клиентами"""
+    # Клиент для обычных запросов к Bot API: пул рассчитан на параллельные обработчики и рассылки
+    request = HTTPXRequest(
+        connection_pool_size=BOT_CONNECTION_POOL_SIZE,
+        connect_timeout=BOT_CONNECT_TIMEOUT,
+        read_timeout=BOT_READ_TIMEOUT,
+        write_timeout=BOT_WRITE_TIMEOUT,
+        pool_timeout=BOT_POOL_TIMEOUT
+    )
+    
+    # Отдельный клиент для getUpdates, чтобы long polling не занимал соединения обработчиков
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        connect_timeout=BOT_CONNECT_TIMEOUT,
+        read_timeout=BOT_GET_UPDATES_READ_TIMEOUT,
+        write_timeout=BOT_WRITE_TIMEOUT,
+        pool_timeout=BOT_POOL_TIMEOUT
+    )
+    
+    return (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_init(resume_broadcasts)
+        .post_stop(stop_broadcasts)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
 
 def main():
     """Основная функция запуска бота"""
     # Инициализация базы данных
     initialize_database()
+    
+    # Загрузка очереди удаления сообщений, оставшейся с прошлого запуска
+    deletion_scheduler.load()
 
     # Загрузка токена из переменных окружения
     token = os.getenv('TELEGRAM_BOT_TOKEN', '8490576810:AAF-wMqonWDLERDi_Wv4r95UYCHt74xWQtQ')
 
     # Создание приложения
-    application = Application.builder().token(token).build()
+    application = build_application(token)
 
+    # Сбор имен пользователей из всех входящих обновлений (до остальных обработчиков)
+    application.add_handler(user_tracker_handler, group=-1)
+    
     # Добавление обработчиков
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('bindgroup', bindgroup))
@@ -531,7 +551,8 @@ def main():
     application.add_handler(CommandHandler('titles', titles_command))
     
     # Добавляем обработчик всех текстовых сообщений для отслеживания активности
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # (в отдельной группе, чтобы его не перекрывали другие обработчики текста)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message), group=1)
     
     # Настройка JobQueue для напоминаний
     job_queue = application.job_queue
@@ -542,9 +563,28 @@ def main():
         
         # Запускаем фоновую задачу проверки истёкших титулов
         job_queue.run_repeating(check_expired_titles, interval=3600, first=10)  # Проверка каждый час, первая проверка через 10 секунд
+        
+        # Периодический чекпоинт WAL, чтобы файл журнала не рос бесконечно
+        job_queue.run_repeating(checkpoint_database, interval=DB_CHECKPOINT_INTERVAL, first=DB_CHECKPOINT_INTERVAL, name='wal_checkpoint')
+        
+        # Пакетная запись активности пользователей из буфера
+        job_queue.run_repeating(flush_activity, interval=ACTIVITY_FLUSH_INTERVAL, first=ACTIVITY_FLUSH_INTERVAL, name='activity_flush')
+        
+        # Пакетное начисление XP за сообщения и уведомления о новых уровнях
+        job_queue.run_repeating(flush_xp, interval=XP_FLUSH_INTERVAL, first=XP_FLUSH_INTERVAL, name='xp_flush')
+        
+        # Перезагрузка таблицы лидеров из базы
+        job_queue.run_repeating(refresh_leaderboard, interval=LEADERBOARD_RELOAD_INTERVAL, first=LEADERBOARD_RELOAD_INTERVAL, name='leaderboard_reload')
+        job_queue.run_repeating(maintain_ledger, interval=LEDGER_SNAPSHOT_INTERVAL, first=LEDGER_SNAPSHOT_INTERVAL, name='ledger_maintenance')
+        
+        # Пакетная запись имен пользователей в базу
+        job_queue.run_repeating(flush_identities, interval=IDENTITY_FLUSH_INTERVAL, first=IDENTITY_FLUSH_INTERVAL, name='identity_flush')
+        
+        # Единый таймер отложенного удаления игровых сообщений
+        job_queue.run_repeating(process_deletions, interval=DELETION_TICK, first=DELETION_TICK, name='message_deletion')
 
     # Запуск бота
-    application.run_polling()
+    application.run_polling(timeout=BOT_POLL_TIMEOUT)
 
 async def uploadvpn(update, context):
     """Админ-команда для массовой загрузки VPN-промокодов"""
@@ -573,7 +613,7 @@ async def uploadvpn(update, context):
                 codes.append((code.strip(), code_type.strip()))
     
     # Добавляем промокоды в базу данных
-    add_vpn_codes(codes)
+    await add_vpn_codes(codes)
     
     await update.message.reply_text(f'✅ Загружено {len(codes)} VPN-промокодов.')
 
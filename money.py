@@ -0,0 +1,75 @@
+import re
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+# Балансы хранятся и считаются в целых сотых долях монеты (centi-coins),
+# чтобы ставки с множителями (x1.5, x2) не накапливали ошибку округления float
+CENTS_PER_COIN = 100
+
+# Максимальная сумма, которую можно ввести (в монетах): защищает от переполнения INTEGER в SQLite
+MAX_INPUT_COINS = 10 ** 9
+
+# Сумма в обычной записи: необязательный минус, целая часть и до двух знаков после точки или запятой
+_AMOUNT_RE = re.compile(r'-?\d+(?:[.,]\d{1,2})?')
+
+
+def to_cents(coins: int | float | str | Decimal) -> int:
+    """
+    Переводит сумму в монетах в сотые доли с округлением до ближайшей сотой.
+    """
+    return int((Decimal(str(coins)) * CENTS_PER_COIN).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> float:
+    """
+    Переводит сотые доли в монеты (для JSON-ответов веб-API).
+    """
+    return cents / CENTS_PER_COIN
+
+
+def parse_coins(text: str) -> int | None:
+    """
+    Разбирает сумму, введенную пользователем ("10", "10.5", "10,50"), в сотые доли.
+    Возвращает None, если строка не является суммой в обычной записи (экспонента не допускается),
+    в ней больше двух знаков после запятой или она по модулю больше MAX_INPUT_COINS.
+    """
+    if not isinstance(text, str) or not _AMOUNT_RE.fullmatch(text.strip()):
+        return None
+
+    value = Decimal(text.strip().replace(',', '.'))
+    if abs(value) > MAX_INPUT_COINS:
+        return None
+    return int(value * CENTS_PER_COIN)
+
+
+def parse_json_coins(value) -> int | None:
+    """
+    Разбирает сумму из JSON-запроса веб-API в сотые доли. Строка разбирается как parse_coins(),
+    число переводится через to_cents() с округлением до сотой.
+    Возвращает None для других типов, нечисловых значений и сумм по модулю больше MAX_INPUT_COINS.
+    """
+    if isinstance(value, str):
+        return parse_coins(value)
+    # bool - подкласс int, но суммой не является
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+
+    amount = Decimal(str(value))
+    if not amount.is_finite() or abs(amount) > MAX_INPUT_COINS:
+        return None
+    return to_cents(amount)
+
+
+def scale(cents: int, multiplier: int | float | str) -> int:
+    """
+    Умножает сумму на коэффициент выигрыша, отбрасывая доли меньше сотой.
+    """
+    return int((Decimal(cents) * Decimal(str(multiplier))).to_integral_value(rounding=ROUND_DOWN))
+
+
+def format_coins(cents: int) -> str:
+    """
+    Форматирует сумму для сообщений: целые монеты без дробной части, иначе две цифры после точки.
+    """
+    sign = '-' if cents < 0 else ''
+    coins, rest = divmod(abs(cents), CENTS_PER_COIN)
+    return f'{sign}{coins}' if rest == 0 else f'{sign}{coins}.{rest:02d}'
@@ -1,7 +1,6 @@
 from telegram.ext import ContextTypes, CommandHandler
 from telegram import Update
-import database
-from games import update_user_balance
+import async_db
 
 
 async def ref_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -11,7 +10,7 @@ async def ref_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Получаем количество приглашенных пользователей
-    referral_count = database.get_referral_count(user_id)
+    referral_count = await async_db.get_referral_count(user_id)
     
     # Генерируем реферальную ссылку
     bot_username = context.bot.username
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from telegram.ext import ContextTypes
+from async_db import get_users_to_remind_page, mark_users_reminded
+from broadcast import rate_limiter, send_limited
+
+REMINDER_INACTIVE_DAYS = int(os.getenv('REMINDER_INACTIVE_DAYS', '3'))  # Через сколько дней неактивности напоминать
+REMINDER_PAGE_SIZE = int(os.getenv('REMINDER_PAGE_SIZE', '500'))  # Пользователей на одну выборку из базы
+REMINDER_CONCURRENCY = int(os.getenv('REMINDER_CONCURRENCY', '10'))  # Одновременных отправок
+REMINDER_TEXT = "Мы скучаем! Возвращайся в чат, чтобы получить бонус!"
+
+logger = logging.getLogger(__name__)
+
+# Метрики последнего запуска рассылки напоминаний
+last_run_stats = {}
+
+
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Отправляет напоминания неактивным пользователям. Пользователи читаются из базы
+    страницами, сообщения отправляются параллельно через общий с рассылками ограничитель скорости.
+    Отмечаются все, кому отправлялось напоминание, в том числе недоставленное
+    (бот заблокирован, аккаунт удален): иначе они перебирались бы заново при каждом запуске.
+    """
+    cutoff = datetime.now() - timedelta(days=REMINDER_INACTIVE_DAYS)
+    semaphore = asyncio.Semaphore(REMINDER_CONCURRENCY)
+
+    started = time.monotonic()
+    last_user_id = 0
+    sent = failed = 0
+
+    try:
+        while True:
+            user_ids = await get_users_to_remind_page(cutoff, last_user_id, REMINDER_PAGE_SIZE)
+            if not user_ids:
+                break
+
+            results = await asyncio.gather(
+                *(send_limited(context.bot, rate_limiter, semaphore, user_id, REMINDER_TEXT) for user_id in user_ids)
+            )
+            await mark_users_reminded(user_ids)
+
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            last_user_id = user_ids[-1]
+    except Exception as e:
+        logger.error(f'Рассылка напоминаний прервана на пользователе {last_user_id}: {e}')
+
+    elapsed = time.monotonic() - started
+    rate = (sent + failed) / elapsed if elapsed > 0 else 0.0
+    last_run_stats.update({
+        'finished_at': datetime.now(),
+        'sent': sent,
+        'failed': failed,
+        'elapsed_seconds': elapsed,
+        'messages_per_second': rate
+    })
+    logger.info(f'Напоминания: отправлено {sent}, не доставлено {failed}, '
+                f'за {elapsed:.1f} с ({rate:.1f} сообщений/с)')
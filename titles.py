@@ -3,20 +3,19 @@ from datetime import datetime, timedelta
 from telegram import Update, ChatAdministratorRights
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
-from database import get_user_balance, update_user_balance, add_temp_title, get_expired_titles, remove_temp_title, get_bound_supergroup_id
+from database import get_bound_supergroup_id
+from money import to_cents, format_coins
+from async_db import get_user_balance, debit_if_sufficient, add_temp_title, get_expired_titles, remove_temp_title
+from decorators import is_bound_supergroup
+from locks import serialized_per_user
 
 async def check_supergroup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """
     Проверяет, что команда вызвана в привязанной супергруппе.
     Возвращает True, если проверка пройдена, иначе отправляет сообщение об ошибке и возвращает False.
     """
-    from database import get_bound_supergroup_id
-    
-    chat_id = update.effective_chat.id
-    bound_supergroup_id = get_bound_supergroup_id()
-    
     # Проверяем, что чат - это привязанная супергруппа
-    if update.effective_chat.type not in ['group', 'supergroup'] or chat_id != bound_supergroup_id:
+    if not is_bound_supergroup(update.effective_chat):
         await update.message.reply_text('❌ Эта команда может быть использована только в привязанной супергруппе.')
         return False
     
@@ -39,6 +38,7 @@ TEMPORARY_TITLES = {
     'Титул на 30 дней': {'price': 15000, 'duration_days': 30}
 }
 
+@serialized_per_user
 async def buytitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработчик команды /buytitle для покупки пожизненного титула.
@@ -62,17 +62,13 @@ async def buytitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f'❌ Такой титул не существует.\nДоступные титулы: {available_titles}')
         return
     
-    # Проверяем баланс пользователя
-    price = PERMANENT_TITLES[title]
-    balance = get_user_balance(user_id)
-    
-    if balance < price:
-        await update.message.reply_text(f'❌ Недостаточно средств. Титул "{title}" стоит {price} LumeCoin, а у вас {balance} LumeCoin.')
+    # Списываем средства, только если их хватает: проверка и списание - одна операция
+    price = to_cents(PERMANENT_TITLES[title])
+    if await debit_if_sufficient(user_id, price, reason='title') is None:
+        balance = await get_user_balance(user_id)
+        await update.message.reply_text(f'❌ Недостаточно средств. Титул "{title}" стоит {format_coins(price)} LumeCoin, а у вас {format_coins(balance)} LumeCoin.')
         return
     
-    # Списываем средства
-    update_user_balance(user_id, -price)
-    
     try:
         # Проверяем, является ли пользователь уже администратором
         chat_member = await context.bot.get_chat_member(chat_id, user_id)
@@ -135,6 +131,7 @@ async def buytitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('❌ Произошла ошибка при установке титула. Возможно, у бота недостаточно прав.')
 
 
+@serialized_per_user
 async def renttitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработчик команды /renttitle для аренды временного титула.
@@ -160,19 +157,15 @@ async def renttitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Получаем параметры титула
     title_info = TEMPORARY_TITLES[title]
-    price = title_info['price']
+    price = to_cents(title_info['price'])
     duration_days = title_info['duration_days']
     
-    # Проверяем баланс пользователя
-    balance = get_user_balance(user_id)
-    
-    if balance < price:
-        await update.message.reply_text(f'❌ Недостаточно средств. Аренда "{title}" стоит {price} LumeCoin, а у вас {balance} LumeCoin.')
+    # Списываем средства, только если их хватает: проверка и списание - одна операция
+    if await debit_if_sufficient(user_id, price, reason='title') is None:
+        balance = await get_user_balance(user_id)
+        await update.message.reply_text(f'❌ Недостаточно средств. Аренда "{title}" стоит {format_coins(price)} LumeCoin, а у вас {format_coins(balance)} LumeCoin.')
         return
     
-    # Списываем средства
-    update_user_balance(user_id, -price)
-    
     try:
         # Проверяем, является ли пользователь уже администратором
         chat_member = await context.bot.get_chat_member(chat_id, user_id)
@@ -232,7 +225,7 @@ async def renttitle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         expires_at = datetime.now() + timedelta(days=duration_days)
         
         # Сохраняем информацию о временном титуле
-        add_temp_title(user_id, chat_id, title, expires_at)
+        await add_temp_title(user_id, chat_id, title, expires_at)
         
         await update.message.reply_text(f'🎉 Поздравляем! Вы арендовали титул "{title}" на {duration_days} дней.')
         
@@ -252,7 +245,7 @@ async def check_expired_titles(context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Получаем список истёкших титулов
-    expired_titles = get_expired_titles()
+    expired_titles = await get_expired_titles()
     
     for user_id, chat_id in expired_titles:
         try:
@@ -279,7 +272,7 @@ async def check_expired_titles(context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Удаляем запись о временном титуле из БД
-            remove_temp_title(user_id, chat_id)
+            await remove_temp_title(user_id, chat_id)
             
             # Опционально: отправляем пользователю уведомление в ЛС
             try:
@@ -0,0 +1,171 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+
+WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_WINDOW', '0.005'))  # Сколько секунд собирать записи в одну транзакцию
+WRITE_BATCH_MAX = int(os.getenv('WRITE_BATCH_MAX', '256'))  # Максимум операций в одной транзакции
+
+logger = logging.getLogger(__name__)
+
+
+class Abort(Exception):
+    """
+    Исключение, которым операция отменяет свои изменения, не считаясь ошибкой.
+    Вызывающий код получает value как результат операции.
+    """
+
+    def __init__(self, value=None):
+        super().__init__(value)
+        self.value = value
+
+
+class GroupCommitWriter:
+    """
+    Единственный поток записи в базу. Операции приходят через очередь, все операции,
+    пришедшие в течение WRITE_BATCH_WINDOW, выполняются в одной транзакции
+    и фиксируются одним COMMIT. Каждая операция выполняется в своей точке сохранения,
+    поэтому ошибка одной операции не откатывает остальные.
+    Операция - функция вида op(cursor, *args), ее результат передается вызывающему
+    после общего COMMIT.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 window: float = WRITE_BATCH_WINDOW, max_batch: int = WRITE_BATCH_MAX):
+        self.connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._operations = 0
+
+    def _ensure_started(self):
+        """
+        Запускает поток записи при первой операции.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, op: Callable, *args) -> Future:
+        """
+        Ставит операцию в очередь записи и возвращает Future с ее результатом.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((op, args, future))
+        return future
+
+    def execute(self, op: Callable, *args):
+        """
+        Выполняет операцию через поток записи и ждет общего COMMIT.
+        Возвращает результат операции или пробрасывает ее исключение.
+        """
+        return self.submit(op, *args).result()
+
+    def stop(self):
+        """
+        Дожидается записи всех поставленных операций и останавливает поток.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        """
+        Возвращает статистику группировки: число транзакций и операций.
+        """
+        return {
+            'batches': self._batches,
+            'operations': self._operations,
+            'avg_batch': self._operations / self._batches if self._batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
+
+    def _collect(self, first) -> tuple[list, bool]:
+        """
+        Собирает операции, пришедшие в течение окна группировки.
+        Возвращает (операции, нужно ли остановиться после их записи).
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        """
+        Основной цикл потока записи.
+        """
+        conn = self.connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                batch, stop = self._collect(item)
+                self._commit_batch(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        """
+        Выполняет операции одной транзакцией и передает результаты вызывающим после COMMIT.
+        """
+        results = []
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for op, args, _ in batch:
+                cursor.execute('SAVEPOINT op')
+                try:
+                    results.append((True, op(cursor, *args)))
+                    cursor.execute('RELEASE op')
+                except Abort as e:
+                    cursor.execute('ROLLBACK TO op')
+                    cursor.execute('RELEASE op')
+                    results.append((True, e.value))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO op')
+                    cursor.execute('RELEASE op')
+                    results.append((False, e))
+            conn.commit()
+        except Exception as e:
+            # Транзакция целиком не удалась - сообщаем об ошибке всем операциям пакета
+            logger.error(f'Ошибка при групповой записи в базу: {e}')
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self._batches += 1
+        self._operations += len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)